@@ -0,0 +1,413 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Headless benchmarks for meh's hot paths (no window is opened).
+
+usage: bench.py [-h] [-o OUT] [--tree TREE] [--images IMAGES]
+                [--size SIZE] [--entries ENTRIES] [--repeat REPEAT]
+                [--workers WORKERS] [--only NAME [NAME ...]]
+
+Generates a synthetic image tree (mixed JPEG/PNG/GIF/WebP, deep and wide
+folder layouts, EXIF-rotated JPEGs), times each benchmark and writes the
+results as JSON, so runs of different versions can be compared.
+
+Benchmarks:
+    scan        update_imagepaths over the deep and the wide tree
+    pipeline    selectImage + resizeImage, zoomed, zoomed -p (first pass only) and 1:1,
+                nothing cached
+    decode      decoding the whole tree for the window on WORKERS threads,
+                then with a ProcessDecoder of WORKERS processes
+    gif         stepping through the frames of a long GIF, first and second pass
+    dirnav      first_of_next_dir / last_of_prev_dir over a large list
+    delete      dropping entries (what delete_file does to the list) from a large list
+    filter      Catalog.select over a large list, first (masks and sort orders made)
+                and again (reusing them), as when the filter or sort is changed
+    display     putting 4K stills and GIF frames on a Tk canvas, a new photo and canvas
+                item each time (as before PhotoBuffers) against reused ones (needs a display)
+"""
+
+import os, sys, json, time, random, shutil, tempfile, platform
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+from pathlib import Path
+from argparse import ArgumentParser
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import meh
+from PIL import Image
+
+
+def stats(samples):
+    '''
+    Latency percentiles (ms) and throughput (per second) of samples (seconds).
+    '''
+    ordered = sorted(samples)
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+    total = sum(samples)
+    return {
+        'samples':    len(samples),
+        'mean_ms':    total / len(samples) * 1000,
+        'p50_ms':     percentile(50),
+        'p90_ms':     percentile(90),
+        'p99_ms':     percentile(99),
+        'max_ms':     ordered[-1] * 1000,
+        'per_second': len(samples) / total if total else None,
+    }
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def makeImage(size, seed):
+    # something for the codecs to chew on, not a flat colour
+    rng = random.Random(seed)
+    small = Image.new('RGB', (16, 12))
+    small.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256)) for i in range(16*12)])
+    return small.resize(size, Image.BILINEAR)
+
+
+def makeTree(root, images, size):
+    '''
+    root/deep: a few images per folder, folders nested 8 deep.
+    root/wide: many images in each of a few folders.
+    '''
+    kinds = ('.jpg', '.jpg', '.png', '.webp', '.jpg')
+    for layout in ('deep', 'wide'):
+        for i in range(images):
+            if layout == 'deep':
+                dir = root / layout
+                for level in range(i // 4 % 8):
+                    dir = dir / 'd{}'.format((i // 32 + level) % 3)
+            else:
+                dir = root / layout / 'w{}'.format(i % 4)
+            dir.mkdir(parents=True, exist_ok=True)
+            ext = kinds[i % len(kinds)]
+            img = makeImage(size, i)
+            path = dir / 'img{:05}{}'.format(i, ext)
+            if ext == '.jpg' and i % 3 == 0:
+                # rotated by EXIF
+                exif = Image.Exif()
+                exif[meh.EXIF_ORIENTATION_TAG] = (3, 6, 8)[i % 9 // 3]
+                img.save(path, quality=90, exif=exif)
+            else:
+                img.save(path)
+    # one long animation
+    frames = [makeImage((size[0] // 4, size[1] // 4), i).convert('P') for i in range(120)]
+    frames[0].save(root / 'wide' / 'anim.gif', save_all=True, append_images=frames[1:], duration=40, loop=0)
+
+
+def headless(paths, zoomed=True, cache_mb=meh.CACHE_MB, box=(1920, 1080), progressive=False):
+    return meh.SlideShow(pathlist=[str(p) for p in paths], recurse=True, regex='.',
+                         fullscreen=False, paused=True, delay=10, zoomed=zoomed,
+                         width=box[0], height=box[1], x=0, y=0, shuffle=False,
+                         cache_mb=cache_mb, window=False, progressive=progressive)
+
+
+def benchScan(tree, repeat):
+    results = {}
+    for layout in ('deep', 'wide'):
+        show = headless([tree / layout])
+        samples = [timed(show.update_imagepaths) for i in range(repeat)]
+        results[layout] = dict(stats(samples), images=len(show.imagepaths))
+        show.stop_workers()
+    return results
+
+
+def benchPipeline(tree, repeat):
+    results = {}
+    for name, zoomed, progressive in (('zoomed', True, False), ('zoomed_progressive', True, True), ('1to1', False, False)):
+        # no cache, no prefetch: every slide is a cold decode
+        show = headless([tree / 'deep', tree / 'wide'], zoomed=zoomed, cache_mb=0, progressive=progressive)
+        samples = []
+        for r in range(repeat):
+            for i in range(show.length):
+                show.index = i
+                start = time.perf_counter()
+                show.selectImage(force=True)
+                show.resizeImage()
+                samples.append(time.perf_counter() - start)
+        show.stop_animation()
+        show.stop_workers()
+        results[name] = stats(samples)
+    return results
+
+
+def benchDecode(tree, workers, repeat):
+    paths = sorted(path for path in tree.rglob('*') if path.suffix in ('.jpg', '.png', '.webp', '.gif'))
+    box = (1920, 1080)
+    results = {'images': len(paths), 'workers': workers}
+    decoder = meh.ProcessDecoder(workers)
+    # start the processes before timing
+    decoder(paths[0], box)
+    for name, decode in (('threads', meh.decodeImage), ('processes', decoder)):
+        samples = []
+        elapsed = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for r in range(repeat):
+                start = time.perf_counter()
+                samples += executor.map(lambda path: timed(decode, path, box), paths)
+                elapsed += time.perf_counter() - start
+        results[name] = dict(stats(samples), images_per_second=len(samples) / elapsed)
+    decoder.close()
+    return results
+
+
+def benchGif(tree, repeat):
+    decoded = meh.decodeImage(tree / 'wide' / 'anim.gif')
+    results = {}
+    for size in ((480, 270), None):
+        animation = meh.Animation(decoded, makePhoto=lambda frame: frame)
+        # first pass decodes (and scales), later passes hit the buffers
+        first, later = [], []
+        for r in range(repeat + 1):
+            for i in range(120):
+                start = time.perf_counter()
+                animation.advance()
+                animation.photo(size)
+                (first if r == 0 else later).append(time.perf_counter() - start)
+        animation.close()
+        name = 'scaled' if size else '1to1'
+        results[name] = {'first_pass': stats(first), 'later_passes': stats(later)}
+    return results
+
+
+def syntheticPaths(entries):
+    # many folders of varying size, some with subfolders sorting in between
+    paths = []
+    rng = random.Random(1)
+    folder = 0
+    while len(paths) < entries:
+        dir = Path('/library/f{:05}'.format(folder))
+        for i in range(rng.choice((1, 5, 50, 500))):
+            paths.append(dir / 'img{:05}.jpg'.format(i))
+        if folder % 7 == 0:
+            for i in range(20):
+                paths.append(dir / 'sub' / 'img{:05}.jpg'.format(i))
+        folder += 1
+    paths.sort()
+    return paths[:entries]
+
+
+def benchDirnav(tree, entries, repeat):
+    show = headless([tree / 'wide'])
+    show.imagepaths = meh.PathStore(syntheticPaths(entries))
+    show.update_runs()
+    results = {}
+    for name in ('first_of_next_dir', 'last_of_prev_dir'):
+        function = getattr(show, name)
+        samples = []
+        rng = random.Random(2)
+        for i in range(repeat * 100):
+            show.index = rng.randrange(show.length)
+            samples.append(timed(function))
+        results[name] = stats(samples)
+    results['entries'] = entries
+    results['folder_runs'] = len(show.folder_runs()[0])
+    show.stop_workers()
+    return results
+
+
+def benchDelete(tree, entries, repeat):
+    show = headless([tree / 'wide'])
+    paths = syntheticPaths(entries)
+    samples = []
+    for r in range(repeat):
+        show.imagepaths = meh.PathStore(paths)
+        show.update_runs()
+        # (kept in step with each delete)
+        show.folder_runs()
+        rng = random.Random(r)
+        # delete a tenth of the list, one at a time
+        for i in range(entries // 10):
+            show.index = show.imagepaths.next_alive(rng.randrange(show.length))
+            samples.append(timed(show.drop_index, show.index))
+    show.stop_workers()
+    return dict(stats(samples), entries=entries)
+
+
+def benchFilter(entries, repeat):
+    # the synthetic paths are not on disk: made-up mtime and size columns instead of stat'ing
+    paths = syntheticPaths(entries)
+    rng = random.Random(3)
+    filters = ('img000', 'ext:jpg dir:sub', 'size:1M..', 'img0 mtime:2020.. sort:-mtime', 'sort:natural', 'sort:size')
+    first = {text: [] for text in filters}
+    again = {text: [] for text in filters}
+    lookup = {text: [] for text in filters}
+    for r in range(repeat):
+        catalog = meh.Catalog(meh.PathStore(paths))
+        catalog.columns['mtime'] = array('q', (rng.randrange(1500000000, 1700000000) * 10**9 for i in range(entries)))
+        catalog.columns['size'] = array('q', (rng.randrange(10**4, 10**7) for i in range(entries)))
+        for text in filters:
+            filter = meh.Filter(text)
+            # masks and orders made, then kept
+            first[text].append(timed(catalog.select, filter))
+            again[text].append(timed(catalog.select, filter))
+            # finding the current image again in what the filter shows
+            view = catalog.view(filter, own=True)
+            for i in range(100):
+                lookup[text].append(timed(view.index_of, paths[rng.randrange(entries)]))
+    return {'entries': entries,
+            'first': {text: stats(samples) for text, samples in first.items()},
+            'again': {text: stats(samples) for text, samples in again.items()},
+            'index_of': {text: stats(samples) for text, samples in lookup.items()}}
+
+
+def benchDisplay(tree, repeat):
+    import tkinter as tk
+    from PIL import ImageTk
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        return {'skipped': str(e)}
+    size = (3840, 2160)
+    canvas = tk.Canvas(root, width=size[0], height=size[1], bd=0, highlightthickness=0)
+    canvas.pack()
+    root.update()
+    stills = [makeImage(size, i) for i in range(4)]
+    item = None
+    photo = shown = None
+
+    def newItem(photo):
+        nonlocal item
+        if item:
+            canvas.delete(item)
+        item = canvas.create_image(size[0]/2, size[1]/2, image=photo)
+        root.update_idletasks()
+
+    def sameItem(photo):
+        nonlocal item
+        if item is None:
+            item = canvas.create_image(size[0]/2, size[1]/2, image=photo)
+        else:
+            canvas.itemconfigure(item, image=photo)
+        root.update_idletasks()
+
+    results = {'still': {}, 'gif': {}}
+    buffers = meh.PhotoBuffers()
+    for name in ('new_photo', 'reused'):
+        samples = []
+        for r in range(repeat):
+            for img in stills:
+                start = time.perf_counter()
+                if name == 'new_photo':
+                    photo = ImageTk.PhotoImage(img)
+                    newItem(photo)
+                else:
+                    shown = buffers.photo(img, (shown,))
+                    sameItem(shown)
+                samples.append(time.perf_counter() - start)
+        results['still'][name] = stats(samples)
+    canvas.delete(item)
+    item = None
+    decoded = meh.decodeImage(tree / 'wide' / 'anim.gif')
+    for name, show in (('new_item', newItem), ('reused_item', sameItem)):
+        # (an animation keeps its photos, only the first pass makes them)
+        animation = meh.Animation(decoded)
+        first, later = [], []
+        for r in range(repeat + 1):
+            for i in range(120):
+                start = time.perf_counter()
+                animation.advance()
+                show(animation.photo((1920, 1080)))
+                (first if r == 0 else later).append(time.perf_counter() - start)
+        animation.close()
+        results['gif'][name] = {'first_pass': stats(first), 'later_passes': stats(later)}
+    root.destroy()
+    return results
+
+
+BENCHMARKS = ('scan', 'pipeline', 'decode', 'gif', 'dirnav', 'delete', 'filter', 'display')
+
+
+def main():
+    parser = ArgumentParser(description='Headless benchmarks for meh.')
+    parser.add_argument('-o', '--out',
+                        help='write JSON results here (default: stdout)',
+                        default=None)
+    parser.add_argument('--tree',
+                        help='use (or make) the image tree here instead of a temporary folder',
+                        default=None)
+    parser.add_argument('--images',
+                        type=int,
+                        help='images per layout in the generated tree',
+                        default=200)
+    parser.add_argument('--size',
+                        help='size of the generated images, wxh',
+                        default='4000x3000')
+    parser.add_argument('--entries',
+                        type=int,
+                        help='entries in the synthetic list for dirnav, delete and filter',
+                        default=200000)
+    parser.add_argument('--repeat',
+                        type=int,
+                        help='passes per benchmark',
+                        default=3)
+    parser.add_argument('--workers',
+                        type=int,
+                        help='threads (and processes) for decode',
+                        default=os.cpu_count())
+    parser.add_argument('--only',
+                        nargs='+',
+                        choices=BENCHMARKS,
+                        help='run only these benchmarks',
+                        default=BENCHMARKS)
+    args = parser.parse_args()
+
+    size = tuple(int(n) for n in args.size.split('x'))
+    temp = None
+    if args.tree:
+        tree = Path(args.tree)
+    else:
+        temp = tempfile.mkdtemp(prefix='meh-bench-')
+        tree = Path(temp)
+    if not (tree / 'wide' / 'anim.gif').exists():
+        print('Making image tree in "{}"'.format(tree), file=sys.stderr)
+        makeTree(tree, args.images, size)
+
+    results = {}
+    try:
+        for name in args.only:
+            print('Running {}'.format(name), file=sys.stderr)
+            if name == 'scan':
+                results[name] = benchScan(tree, args.repeat)
+            elif name == 'pipeline':
+                results[name] = benchPipeline(tree, args.repeat)
+            elif name == 'decode':
+                results[name] = benchDecode(tree, args.workers, args.repeat)
+            elif name == 'gif':
+                results[name] = benchGif(tree, args.repeat)
+            elif name == 'dirnav':
+                results[name] = benchDirnav(tree, args.entries, args.repeat)
+            elif name == 'delete':
+                results[name] = benchDelete(tree, args.entries, args.repeat)
+            elif name == 'filter':
+                results[name] = benchFilter(args.entries, args.repeat)
+            elif name == 'display':
+                results[name] = benchDisplay(tree, args.repeat)
+    finally:
+        if temp:
+            shutil.rmtree(temp, ignore_errors=True)
+
+    report = {
+        'time':     time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python':   platform.python_version(),
+        'pillow':   Image.__version__,
+        'platform': platform.platform(),
+        'cpus':     os.cpu_count(),
+        'settings': {'images': args.images, 'size': args.size, 'entries': args.entries, 'repeat': args.repeat, 'workers': args.workers},
+        'results':  results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,16 +3,27 @@
 """
 I wanted something like feh (image viewer) on Windows, so I built this.
 
-usage: meh.py [-h] [--regex [REGEX]] [-r] [-R] [-f] [-z] [-a] [-d DELAY]
-              [-g GEOMETRY]
+usage: meh.py [-h] [--regex [REGEX]] [--filter FILTER] [--sort SORT] [-R] [-f]
+              [-z] [-a] [-d DELAY] [-g GEOMETRY] [-p] [-r] [-v [TRACE]]
+              [--cache-mb CACHE_MB] [--index [INDEX]] [-w] [--previews [MB]]
+              [--warm-previews] [--montage OUT] [--thumb THUMB]
+              [--columns COLUMNS] [--rows ROWS] [--labels] [-m]
+              [--decode-processes N] [--resident] [--pane OPTIONS]
               [paths [paths ...]]
 
 positional arguments:
-  paths                 path(s) to image(s) or folder(s) of image(s)
+  paths                 path(s) to image(s), folder(s) of image(s) or ZIP/CBZ
+                        archive(s) of image(s) (shown like folders)
 
 optional arguments:
   -h, --help            show this help message and exit
   --regex [REGEX]       regex filter on file paths
+  --filter FILTER       show only the images matching every term, e.g. "beach
+                        ext:jpg,png dir:2019 size:1M.. mtime:2020..2021-06
+                        w:3000.. sort:-mtime" (a bare term is a regex,
+                        / changes it while the slide show runs)
+  --sort SORT           order of the images: path, name, natural, mtime or
+                        size (- in front for descending)
   -r, --recurse         recurse though path directory
   -R, --random          shuffle order
   -f, --fullscreen      set to fullscreen mode
@@ -23,6 +34,48 @@ optional arguments:
                         delay (in seconds) before new slide is shown
   -g GEOMETRY, --geometry GEOMETRY
                         window geometry in the form wxh+x+y (from top-left)
+  -v [TRACE], --verbose [TRACE]
+                        time each stage of showing slides, as JSON lines
+                        appended to TRACE (default: stdout) with rolling
+                        stats every 20 slides
+  -p, --progressive     when skimming, show a quick rendition of images that
+                        are not ready yet, and the full-quality one once
+                        stopped on them
+  --cache-mb CACHE_MB   memory (in MB) for decoded images kept for reuse
+  --index [INDEX]       keep an index of scanned folders in this SQLite file
+                        (default: meh's cache folder) so later scans only
+                        list folders that have changed
+  -w, --watch           follow images being added to, removed from or renamed
+                        in the folders while the slide show runs
+  --previews [MB]       keep window-sized previews on disk (in meh's cache
+                        folder, up to MB) to show zoomed images without
+                        decoding the originals again
+  --warm-previews       make previews for the window size (-g) of the images
+                        in paths that --regex and --filter pick, then exit
+  --montage OUT         write contact sheets of the images (those --regex and
+                        --filter pick, in --sort order) to OUT (.png or .jpg,
+                        numbered if more than one), then exit
+  --thumb THUMB         largest thumbnail on a contact sheet, wxh
+  --columns COLUMNS     thumbnails across a contact sheet
+  --rows ROWS           thumbnails down a contact sheet (more images make
+                        more sheets)
+  --labels              put file names under the thumbnails of a contact
+                        sheet
+  -m, --meta            read image headers (size, orientation, frames) while
+                        scanning, kept in the index if there is one
+  --decode-processes N  decode in N processes instead of threads, to use more
+                        cores
+  --resident            hand the paths and options to the meh already running
+                        with --resident, if there is one, and exit; otherwise
+                        be that meh: keep running for 30 minutes after the
+                        window is closed, and show what later launches hand
+                        over with caches and index warm
+  --pane OPTIONS        open another window on the same images, caches and
+                        decode workers, with its own options (quoted, any of
+                        --regex, --filter, --sort, -R, -f, -z, -a, -d, -g and
+                        -p), e.g. --pane="-g 960x1080+960+0 -a -d 5 --sort
+                        mtime" (with =, as they start with -); may be given
+                        more than once
 
 Controls:
     space             : pause
@@ -35,10 +88,17 @@ Controls:
     z                 : go to random image
     q                 : shuffle/sort sequence
     y                 : reload image list from paths
+    /                 : filter (and sort) the images, see --filter
+    o                 : next sort: path, name, natural (numbers by value), mtime, size
     F11               : toggle fullscreen
+    1                 : actual size (1:1)
+    0                 : fit to window
+    mouse wheel       : zoom in/out (very large images)
+    mouse drag        : pan (very large images)
     escape            : exit
     delete            : delete image from computer (send to Recycle Bin)
-    ctrl+shift+delete : delete folder from computer (send to Recycle Bin)
+    ctrl+shift+delete : delete folder from computer (send to Recycle Bin),
+                        or the archive the image is in
 
 TODO:
     - simplify code
@@ -53,15 +113,19 @@ For SVG:
     image = Image.open(out)
 """
 
-import re, pdb
+import io, os, re, sys, json, math, mmap, time, queue, shlex, shutil, socket, sqlite3, hashlib, zipfile, threading
 from pathlib import Path
 from argparse import ArgumentParser
-from random import randint, shuffle
+from random import getrandbits, shuffle
+from array import array
+from collections import deque, OrderedDict
+from bisect import bisect_left, bisect_right
+from itertools import islice, compress, groupby
+from concurrent.futures import ThreadPoolExecutor
 import tkinter as tk
 # installed
-from PIL import Image, ImageTk, ImageSequence
-import win32gui, win32con
-from send2trash import send2trash
+from PIL import Image, ImageTk
+# (only imported where used: send2trash, and the process pool and PIL drawing modules)
 
 
 EXIF_ORIENTATION_TAG = 0x0112  # https://exiftool.org/TagNames/EXIF.html
@@ -69,11 +133,2782 @@ EXIF_ORIENTATION_TAG = 0x0112  # https://exiftool.org/TagNames/EXIF.html
 DELAY_INC_MS = 1000
 DELAY_MIN_MS = 1000
 
+PREFETCH_AHEAD   = 2 # slides decoded ahead of (and behind) the current one
+PREFETCH_WORKERS = 2
+
+CACHE_MB = 512 # default memory budget for decoded images
+
+CACHE_DIR = Path(os.environ.get('LOCALAPPDATA') or Path.home() / '.cache') / 'meh'
+INDEX_PATH = CACHE_DIR / 'index.sqlite'
+PREVIEW_DIR = CACHE_DIR / 'previews'
+PREVIEW_MB = 1024 # default disk budget for previews
+MONTAGE_GAP   = 4  # pixels around each thumbnail of a contact sheet
+MONTAGE_LABEL = 14 # height of the file name under each thumbnail
+PYRAMID_DIR = CACHE_DIR / 'pyramids'
+PYRAMID_MB  = 4096 # disk budget for tiled pyramids
+PYRAMID_MP  = 50   # images with more megapixels than this are shown from a tiled pyramid
+TILE_SIZE   = 512
+TILE_MB     = 256  # memory for decoded tiles, all pyramids together
+ZOOM_STEP   = 1.25 # per mouse wheel notch
+ZOOM_MAX    = 16   # screen pixels per image pixel
+
+SCAN_WORKERS = 8   # directories listed in parallel (mostly waiting on the disk)
+
+ARCHIVE_TYPES_LC = ('.zip', '.cbz') # shown as folders of their images
+ARCHIVES_OPEN    = 8                # archives kept open (memory-mapped) at once
+SCAN_POLL_MS = 250 # how often found images are merged into a running slide show
+
+SHUFFLE_HISTORY = 1000 # shuffled slides that can be gone back through
+
+COMPACT_MIN = 1024 # deleted entries kept as tombstones before the list is compacted
+
+SORTS = ('path', 'name', 'natural', 'mtime', 'size') # orders the slide show can be in (see Filter)
+FILTER_KINDS = ('sort', 're', 'ext', 'dir', 'size', 'mtime', 'w', 'h') # term prefixes (see Filter)
+SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024**2, 'g': 1024**3}
+STAT_WORKERS = 16 # files stat'ed (or headers read) in parallel when a filter or sort first needs them
+
+WATCH_POLL_MS = 500 # how often watched changes are applied to the slide show
+WATCH_SCAN_S  = 5   # without watchdog, how often folders are checked for changes
+
+ANIM_BUFFER_FRAMES = 32  # decoded frames kept per animation
+ANIM_PHOTO_MB      = 256 # memory for scaled frames kept per animation
+ANIM_MIN_DELAY_MS  = 20  # like browsers, shorter frame durations play at the default
+ANIM_DEFAULT_MS    = 100
+
+PHOTO_SIZES = 2 # sizes of still photos kept for reuse (see PhotoBuffers)
+
+TRACE_WINDOW = 100 # slides the rolling stats of -v are over
+TRACE_REPORT = 20  # slides between rolling stats lines in the trace
+
+SCHEDULE_WINDOW   = 20 # slides the cost of preparing one is measured over (autoplay)
+SCHEDULE_LEAD_MS  = 50 # preparing ahead of the deadline, until measured
+SCHEDULE_SLACK_MS = 20 # added to the measured cost, for timer jitter (Windows timers tick every ~16 ms)
+SCHEDULE_LATE_MS  = 50 # a slide later than this has missed its deadline
+
+REFINE_IDLE_MS = 150 # with -p, time on a quick rendition before the full-quality one is made
+REFINE_POLL_MS = 25
+
+RESIDENT_FILE    = CACHE_DIR / 'resident.json' # how later launches reach a --resident instance
+RESIDENT_POLL_MS = 100
+RESIDENT_IDLE_S  = 1800 # a resident instance with its window closed exits after this long
+RESIDENT_WAIT_S  = 2    # a launch handing over waits this long before starting up itself
+
+
+def fitSize(size, box):
+    '''
+    Largest size with the aspect ratio of size that fits inside box.
+    '''
+    widthratio = float(box[0])/size[0]
+    heightratio = float(box[1])/size[1]
+    if widthratio < heightratio:
+        return (int(box[0]), int(size[1]*widthratio))
+    else:
+        return (int(size[0]*heightratio), int(box[1]))
+
+
+class PathStore:
+    '''
+    Sorted image paths, stored compactly: each folder once, and per entry
+    a folder id plus a name packed into one buffer.
+    Deleting leaves a tombstone, so indices stay put and delete is O(1);
+    compacted() squeezes the tombstones out.
+    insert() splices new entries into the arrays, without going through the others.
+    Lookups bisect the sorted entries (a dict would cost more memory than this saves),
+    comparing the folder's and name's parts as Path does, without making Paths.
+    '''
+    def __init__(self, paths=()):
+        self.dirs    = []          # folder Paths, by id
+        self.dirIds  = {}          # folder Path -> id
+        self.dirKeys = []          # folder's parts, as compared, by id
+        self.dirOf   = array('I')  # folder id per entry
+        self.starts  = array('Q')  # entry i's name is blob[starts[i]:starts[i]+sizes[i]]
+        self.sizes   = array('H')
+        self.blob    = bytearray()
+        for path in paths:
+            self.dirOf.append(self.dir_id(path.parent))
+            name = path.name.encode('utf-8', 'surrogateescape')
+            self.starts.append(len(self.blob))
+            self.sizes.append(len(name))
+            self.blob += name
+        self.alive = bytearray(b'\x01') * len(self.dirOf)
+        self.count = len(self.dirOf) # live entries
+        self.slots = len(self.dirOf) # live and deleted entries
+
+    def dir_id(self, dir):
+        id = self.dirIds.get(dir)
+        if id is None:
+            id = self.dirIds[dir] = len(self.dirs)
+            self.dirs.append(dir)
+            self.dirKeys.append(tuple(map(os.path.normcase, dir.parts)))
+        return id
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        # deleted entries still answer, so their neighbours can be found
+        return self.dirs[self.dirOf[index]] / self.name(index)
+
+    def __iter__(self):
+        for i in range(self.slots):
+            if self.alive[i]:
+                yield self[i]
+
+    def name(self, index):
+        start = self.starts[index]
+        return self.blob[start:start+self.sizes[index]].decode('utf-8', 'surrogateescape')
+
+    def key(self, index):
+        # what Path compares (parts, case folded on Windows)
+        return self.dirKeys[self.dirOf[index]] + (os.path.normcase(self.name(index)),)
+
+    @staticmethod
+    def path_key(path):
+        return tuple(map(os.path.normcase, path.parts))
+
+    def is_alive(self, index):
+        return bool(self.alive[index])
+
+    def delete(self, index):
+        if self.alive[index]:
+            self.alive[index] = 0
+            self.count -= 1
+
+    def next_alive(self, index):
+        '''
+        First live entry at or after index, wrapping around (-1 if none).
+        '''
+        found = self.alive.find(1, index)
+        if found < 0:
+            found = self.alive.find(1, 0, index)
+        return found
+
+    def prev_alive(self, index):
+        '''
+        Last live entry at or before index, wrapping around (-1 if none).
+        '''
+        found = self.alive.rfind(1, 0, index+1)
+        if found < 0:
+            found = self.alive.rfind(1, index+1)
+        return found
+
+    def bisect(self, path, lo=0):
+        '''
+        Where path is, or would be inserted, counting deleted entries (at or after lo).
+        '''
+        key = self.path_key(path)
+        hi = self.slots
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def index_of(self, path):
+        '''
+        Index of a live entry, None if not there.
+        '''
+        i = self.bisect(path)
+        if i < self.slots and self.alive[i] and self[i] == path:
+            return i
+        return None
+
+    def locate(self, entry):
+        # index of a live entry (as a view of itself, see CatalogView.locate)
+        return entry if self.alive[entry] else None
+
+    def runs(self):
+        '''
+        Where each run of consecutive entries in the same folder starts,
+        the folder's id, and how many of the run's entries are live.
+        A folder can have more than one run (its subfolders sort in between).
+        '''
+        return self.runs_of(self.dirOf, self.alive)
+
+    @staticmethod
+    def runs_of(ids, alive):
+        # runs of equal folder ids (an iterable, an id per entry), alive a byte per entry;
+        # as in SlideShow.remove_from_runs, a run with nothing live is left out
+        # (its tombstones join the run before) and the runs either side of it become one
+        starts, dirs, counts = [], [], []
+        full = alive.count(0) == 0
+        start = 0
+        for id, run in groupby(ids):
+            end = start + len(list(run))
+            count = end - start if full else alive.count(1, start, end)
+            if dirs and dirs[-1] == id:
+                counts[-1] += count
+            elif count:
+                # the first run starts at 0 whatever was dropped before it
+                starts.append(start if dirs else 0)
+                dirs.append(id)
+                counts.append(count)
+            start = end
+        if not dirs and start:
+            # nothing live at all, keep one run
+            starts.append(0)
+            dirs.append(id)
+            counts.append(0)
+        return starts, dirs, counts
+
+    def rank(self, index):
+        '''
+        Index in the compacted store (of the next live entry, if index was deleted).
+        '''
+        return self.alive.count(1, 0, index)
+
+    def compacted(self):
+        return PathStore(iter(self))
+
+    def insert(self, paths):
+        '''
+        Add sorted paths (not in the store) where they sort, each a bisect and the arrays
+        copied once around the insertion points, so entries at or after one move up.
+        Returns where each landed, in the arrays before the insert (nondecreasing).
+        '''
+        at = []
+        lo = 0
+        for path in paths:
+            lo = self.bisect(path, lo)
+            at.append(lo)
+        dirOf, starts, sizes, alive = array('I'), array('Q'), array('H'), bytearray()
+        last = 0
+        for i, path in zip(at, paths):
+            dirOf += self.dirOf[last:i]
+            starts += self.starts[last:i]
+            sizes += self.sizes[last:i]
+            alive += self.alive[last:i]
+            name = path.name.encode('utf-8', 'surrogateescape')
+            dirOf.append(self.dir_id(path.parent))
+            starts.append(len(self.blob))
+            sizes.append(len(name))
+            alive.append(1)
+            self.blob += name
+            last = i
+        dirOf += self.dirOf[last:]
+        starts += self.starts[last:]
+        sizes += self.sizes[last:]
+        alive += self.alive[last:]
+        self.dirOf, self.starts, self.sizes, self.alive = dirOf, starts, sizes, alive
+        self.count += len(at)
+        self.slots += len(at)
+        return at
+
+    def under(self, dir):
+        '''
+        Live entries in dir and its subfolders (they sort together).
+        '''
+        key = self.path_key(dir)
+        entries = []
+        i = self.bisect(dir)
+        while i < self.slots and self.dirKeys[self.dirOf[i]][:len(key)] == key:
+            if self.alive[i]:
+                entries.append(i)
+            i += 1
+        return entries
+
+
+class Filter:
+    '''
+    Which images of the catalog to show, and in what order, parsed from text like
+        beach ext:jpg,png dir:2019 size:1M.. mtime:2020..2021-06 w:3000.. sort:-mtime
+    A term without a prefix (one of FILTER_KINDS) is a regex on the path (case-insensitive),
+    colons and all: (?:a|b) is a regex.
+    ext: takes extensions, dir: part of the folder's path.
+    size: (bytes, K/M/G), mtime: (dates, YYYY[-MM[-DD]]), w: and h: (pixels) take lo..hi,
+    either end left out for no limit, or one value (a date stands for the whole year, month or day).
+    sort: is one of SORTS, - in front for descending.
+    Every term must match. Raises ValueError for a term that cannot be parsed.
+    regex is one more regex term (--regex), which may hold spaces: kept apart from text.
+    '''
+    def __init__(self, text='', regex=None):
+        self.text       = text.strip()
+        self.regex      = regex if regex not in ('', '.') else None
+        self.terms      = [] # hashable, see Catalog.mask
+        self.sort       = 'path'
+        self.descending = False
+        if self.regex is not None:
+            try:
+                re.compile(self.regex)
+            except re.error as e:
+                raise ValueError('bad regex "{}": {}'.format(self.regex, e))
+            self.terms.append(('re', self.regex))
+        for word in text.split():
+            kind, colon, value = word.partition(':')
+            kind = kind.lower()
+            if not colon or kind not in FILTER_KINDS:
+                kind, value = 're', word
+            if kind == 'sort':
+                self.descending = value.startswith('-')
+                self.sort = value.lstrip('-').lower()
+                if self.sort not in SORTS:
+                    raise ValueError('sort must be one of {}'.format(', '.join(SORTS)))
+            elif kind == 're':
+                try:
+                    re.compile(value)
+                except re.error as e:
+                    raise ValueError('bad regex "{}": {}'.format(value, e))
+                self.terms.append(('re', value))
+            elif kind == 'ext':
+                self.terms.append(('ext', frozenset('.' + ext.lower().lstrip('.') for ext in value.split(',') if ext)))
+            elif kind == 'dir':
+                self.terms.append(('dir', value.lower()))
+            elif kind == 'size':
+                self.terms.append(('size',) + self.range(value, self.size))
+            elif kind == 'mtime':
+                self.terms.append(('mtime',) + self.range(value, self.date))
+            else:
+                self.terms.append(({'w': 'width', 'h': 'height'}[kind],) + self.range(value, lambda v: (int(v), int(v) + 1)))
+
+    @staticmethod
+    def range(text, parse):
+        '''
+        (lo, hi) from lo..hi (or one value), lo inclusive, hi exclusive, None for no limit.
+        parse gives the (start, end) a value stands for.
+        '''
+        lo, dots, hi = text.partition('..')
+        try:
+            if not dots:
+                return parse(lo)
+            return (parse(lo)[0] if lo else None, parse(hi)[1] if hi else None)
+        except (ValueError, OverflowError):
+            raise ValueError('bad range "{}"'.format(text))
+
+    @staticmethod
+    def size(text):
+        mat = re.fullmatch(r'(\d+(?:\.\d*)?)([kmg]?)b?', text.lower())
+        if not mat:
+            raise ValueError('bad size "{}"'.format(text))
+        size = int(float(mat.group(1)) * SIZE_UNITS[mat.group(2)])
+        return size, size + 1
+
+    @staticmethod
+    def date(text):
+        # (start, end) of the year, month or day, as local mtime_ns
+        parts = [int(part) for part in text.split('-')] if re.fullmatch(r'\d{4}(-\d{1,2}){0,2}', text) else None
+        if not parts:
+            raise ValueError('bad date "{}"'.format(text))
+        start = parts + [1] * (3 - len(parts))
+        end = list(start)
+        end[len(parts) - 1] += 1
+        if end[1] > 12:
+            end[0] += 1
+            end[1] = 1
+        def ns(ymd):
+            # (mktime normalises a day past the end of the month)
+            return int(time.mktime((ymd[0], ymd[1], ymd[2], 0, 0, 0, 0, 0, -1)) * 1e9)
+        return ns(start), ns(end)
+
+    def sorted(self, sort, descending=False):
+        '''
+        The same terms in another order.
+        '''
+        filter = Filter()
+        filter.regex = self.regex
+        filter.terms = self.terms
+        filter.sort = sort
+        filter.descending = descending
+        words = [word for word in self.text.split() if not word.lower().startswith('sort:')]
+        if sort != 'path' or descending:
+            words.append('sort:{}{}'.format('-' if descending else '', sort))
+        filter.text = ' '.join(words)
+        return filter
+
+    def __str__(self):
+        # the text, and the regex if any (quoted, as on the command line)
+        if self.regex is None:
+            return self.text
+        return '{} --regex {}'.format(self.text, shlex.quote(self.regex)).strip()
+
+    def __bool__(self):
+        # whether it changes anything from all images in path order
+        return bool(self.terms) or self.sort != 'path' or self.descending
+
+    def streams(self):
+        # whether it can be applied as the scan goes (see SlideShow.poll_scan):
+        # path order and terms on the path alone, nothing to sort, stat or read a header for
+        return self.sort == 'path' and all(term[0] in ('re', 'ext', 'dir') for term in self.terms)
+
+
+class Catalog:
+    '''
+    Every image scanned, in path order (a PathStore), whatever the filter shows of it.
+    What filters and sorts need is made once and kept while the catalog is unchanged:
+    per entry arrays of mtime, size, width and height (stat'ed or read when first needed,
+    from the index or meta when they have them), a mask per filter term and an order per sort.
+    So changing the filter or sort only combines these, see select.
+    New paths are spliced into the columns and path order masks (see insert),
+    deleted ones only leave tombstones.
+    '''
+    def __init__(self, paths=None, index=None, meta=None):
+        self.paths   = paths if paths is not None else PathStore()
+        self.index   = index # LibraryIndex, or None
+        self.meta    = meta if meta is not None else {} # path -> ImageMeta
+        self.columns = {} # 'mtime', 'size', 'width', 'height' -> array('q'), -1 if unknown
+        self.masks   = {} # (term, sort) -> bytes, 1 per entry that matches
+        self.orders  = {} # sort -> array('I') of entries
+        self.dirRank = None # folder id -> place in natural order, made when first needed
+
+    def strings(self, entries=None):
+        # the entries' paths (by default all, deleted ones too) as strs, cheaper than making Paths
+        prefixes = [os.path.join(str(dir), '') for dir in self.paths.dirs]
+        dirOf = self.paths.dirOf
+        for i in range(self.paths.slots) if entries is None else entries:
+            yield prefixes[dirOf[i]] + self.paths.name(i)
+
+    def column(self, name):
+        if name not in self.columns:
+            pair = ('mtime', 'size') if name in ('mtime', 'size') else ('width', 'height')
+            for column, values in zip(pair, self.measure(pair, range(self.paths.slots), self.index)):
+                self.columns[column] = array('q', values)
+        return self.columns[name]
+
+    def measure(self, pair, entries, index=None):
+        '''
+        Values of the entries for a pair of columns, ('mtime', 'size') or ('width', 'height'),
+        as two lists: stat'ed (or taken from index) or read from the headers (or taken from meta),
+        on a thread pool. -1 where unknown.
+        '''
+        if pair == ('mtime', 'size'):
+            strings = list(self.strings(entries))
+            known = index.stats() if index else {}
+            missing = [path for path in strings if path not in known]
+            with ThreadPoolExecutor(max_workers=STAT_WORKERS) as executor:
+                for path, stat in zip(missing, executor.map(fileStat, missing)):
+                    known[path] = (stat.st_mtime_ns, stat.st_size) if stat else (-1, -1)
+            values = [known[path] for path in strings]
+        else:
+            paths = [self.paths[i] for i in entries]
+            missing = [path for path in paths if self.meta.get(path) is None]
+            with ThreadPoolExecutor(max_workers=STAT_WORKERS) as executor:
+                for path, meta in zip(missing, executor.map(readMeta, missing)):
+                    self.meta[path] = meta
+            if self.index:
+                self.index.store_meta([(str(path), None, None, self.meta[path]) for path in missing
+                                       if self.meta[path] is not None])
+                self.index.commit()
+            values = [self.meta[path].size if self.meta[path] else (-1, -1) for path in paths]
+        return [value[0] for value in values], [value[1] for value in values]
+
+    def insert(self, paths):
+        '''
+        Add sorted new paths (see PathStore.insert), with their values spliced into the columns
+        and path order masks made so far. Sort orders (and masks in them) are made again when next needed.
+        Returns where each landed.
+        '''
+        at = self.paths.insert(paths)
+        entries = [i + j for j, i in enumerate(at)]
+        for pair in (('mtime', 'size'), ('width', 'height')):
+            if pair[0] in self.columns:
+                for column, values in zip(pair, self.measure(pair, entries)):
+                    self.columns[column] = self.splice(self.columns[column], at, values)
+        self.masks = {(term, sort): self.splice(mask, at, self.test(term, entries))
+                      for (term, sort), mask in self.masks.items() if sort == 'path' and term != 'alive'}
+        self.orders = {}
+        self.dirRank = None
+        return entries
+
+    @staticmethod
+    def splice(old, at, values):
+        # a copy of old (an array or bytes) with each value put before old[at[j]], as PathStore.insert does
+        new = bytearray() if isinstance(old, bytes) else array(old.typecode)
+        last = 0
+        for i, value in zip(at, values):
+            new += old[last:i]
+            new.append(value)
+            last = i
+        new += old[last:]
+        return bytes(new) if isinstance(old, bytes) else new
+
+    def mask(self, term, sort='path'):
+        '''
+        bytes with a 1 for each entry that term (see Filter) matches, the entries in sort order.
+        '''
+        if (term, sort) in self.masks:
+            return self.masks[term, sort]
+        if sort != 'path':
+            mask = bytes(map(self.mask(term).__getitem__, self.order(sort)))
+        else:
+            mask = self.test(term)
+        self.masks[term, sort] = mask
+        return mask
+
+    def test(self, term, entries=None):
+        # bytes with a 1 for each of the entries (by default all) that term matches
+        kind = term[0]
+        everything = entries is None
+        if everything:
+            entries = range(self.paths.slots)
+        if kind == 're':
+            search = re.compile(term[1], re.IGNORECASE).search
+            return bytes(search(path) is not None for path in self.strings(entries))
+        if kind == 'ext':
+            return bytes(os.path.splitext(self.paths.name(i))[1].lower() in term[1] for i in entries)
+        if kind == 'dir':
+            # per folder, then spread over the entries
+            folders = bytes(term[1] in str(dir).lower() for dir in self.paths.dirs)
+            if everything:
+                return bytes(map(folders.__getitem__, self.paths.dirOf))
+            return bytes(folders[self.paths.dirOf[i]] for i in entries)
+        lo, hi = term[1], term[2]
+        lo = 0 if lo is None else lo
+        hi = float('inf') if hi is None else hi
+        column = self.column(kind)
+        if everything:
+            return bytes(lo <= value < hi for value in column)
+        return bytes(lo <= column[i] < hi for i in entries)
+
+    def live(self, sort):
+        # like mask, for the entries not deleted, made again after deletes
+        count, mask = self.masks.get(('alive', sort), (None, None))
+        if count != self.paths.count:
+            count, mask = self.paths.count, bytes(self.paths.alive)
+            if sort != 'path':
+                mask = bytes(map(mask.__getitem__, self.order(sort)))
+            self.masks['alive', sort] = count, mask
+        return mask
+
+    def order(self, sort):
+        '''
+        array('I') of all entries (deleted ones too) in sort order, ties in path order
+        (the range of them for path order).
+        '''
+        entries = range(self.paths.slots)
+        if sort == 'path':
+            return entries
+        if sort in self.orders:
+            return self.orders[sort]
+        if sort == 'name':
+            keys = [self.paths.name(i).lower() for i in entries]
+            order = sorted(entries, key=keys.__getitem__)
+        elif sort == 'natural':
+            # folders in natural order, then the names in each
+            rank = self.natural_dirs()
+            dirOf = self.paths.dirOf
+            keys = [(rank[dirOf[i]], naturalKey(self.paths.name(i))) for i in entries]
+            order = sorted(entries, key=keys.__getitem__)
+        else:
+            order = sorted(entries, key=self.column(sort).__getitem__)
+        self.orders[sort] = array('I', order)
+        return self.orders[sort]
+
+    def natural_dirs(self):
+        # each folder's place in natural order, by id
+        if self.dirRank is None:
+            dirs = sorted(range(len(self.paths.dirs)), key=lambda id: naturalKey(str(self.paths.dirs[id])))
+            self.dirRank = array('I', [0]) * len(dirs)
+            for i, id in enumerate(dirs):
+                self.dirRank[id] = i
+        return self.dirRank
+
+    def sort_key(self, sort):
+        '''
+        Function of an entry giving what order(sort) sorts it by, ties broken by the entry
+        (so no two entries have the same key).
+        '''
+        name = self.paths.name
+        if sort == 'path':
+            return lambda entry: entry
+        if sort == 'name':
+            return lambda entry: (name(entry).lower(), entry)
+        if sort == 'natural':
+            rank = self.natural_dirs()
+            dirOf = self.paths.dirOf
+            return lambda entry: (rank[dirOf[entry]], naturalKey(name(entry)), entry)
+        column = self.column(sort)
+        return lambda entry: (column[entry], entry)
+
+    def select(self, filter):
+        '''
+        array('I') of the live entries filter shows, in its order.
+        '''
+        # and the masks together, a byte per entry, as one big int
+        sort = filter.sort
+        mask = int.from_bytes(self.live(sort), 'little')
+        for term in filter.terms:
+            mask &= int.from_bytes(self.mask(term, sort), 'little')
+        mask = mask.to_bytes(self.paths.slots, 'little')
+        order = self.order(sort)
+        if filter.descending:
+            order = order[::-1]
+            mask = mask[::-1]
+        return self.pick(order, mask)
+
+    @staticmethod
+    def pick(order, mask):
+        # compress(order, mask), but a slice at a time when the matches come in few runs
+        # (a folder, a range in its own order), as most filters do
+        if mask.count(b'\x00\x01') >= len(mask) // 64:
+            return array('I', compress(order, mask))
+        picked = array('I')
+        find = mask.find
+        start = find(1)
+        while start >= 0:
+            end = find(0, start)
+            if end < 0:
+                end = len(mask)
+            picked.extend(order[start:end])
+            start = find(1, end)
+        return picked
+
+    def view(self, filter, own=False):
+        '''
+        What filter shows, for the slide show: the PathStore itself if the filter changes nothing,
+        unless own (for a pane sharing the catalog, which must not share its tombstones).
+        '''
+        if not filter and not own:
+            return self.paths
+        return CatalogView(self, self.select(filter), filter.sort, filter.descending)
+
+
+def naturalKey(text):
+    # numbers by value: img2 before img10
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', text.lower())]
+
+
+class CatalogView:
+    '''
+    Some entries of a Catalog in some order (see Filter), kept as an array of entry numbers,
+    with the same interface as PathStore so the slide show can use either.
+    Deleting leaves a tombstone here and deletes the entry from the catalog too.
+    Lookups bisect the entries by their sort key (see Catalog.sort_key).
+    '''
+    def __init__(self, catalog, entries, sort='path', descending=False):
+        self.catalog    = catalog
+        self.entries    = entries # array('I') of catalog entries
+        self.sort       = sort
+        self.descending = descending
+        self.alive      = bytearray(b'\x01') * len(entries)
+        self.count      = len(entries)
+        self.slots      = len(entries)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return self.catalog.paths[self.entries[index]]
+
+    def __iter__(self):
+        for i in range(self.slots):
+            if self.alive[i]:
+                yield self[i]
+
+    def is_alive(self, index):
+        return bool(self.alive[index])
+
+    def delete(self, index):
+        if self.alive[index]:
+            self.alive[index] = 0
+            self.count -= 1
+            self.catalog.paths.delete(self.entries[index])
+
+    def next_alive(self, index):
+        found = self.alive.find(1, index)
+        if found < 0:
+            found = self.alive.find(1, 0, index)
+        return found
+
+    def prev_alive(self, index):
+        found = self.alive.rfind(1, 0, index+1)
+        if found < 0:
+            found = self.alive.rfind(1, index+1)
+        return found
+
+    def seek(self, entry):
+        '''
+        Where a catalog entry is here, or would be in this order.
+        '''
+        if self.sort == 'path' and not self.descending:
+            return bisect_left(self.entries, entry)
+        key = self.catalog.sort_key(self.sort)
+        wanted = key(entry)
+        lo, hi = 0, self.slots
+        while lo < hi:
+            mid = (lo + hi) // 2
+            found = key(self.entries[mid])
+            if (found > wanted) if self.descending else (found < wanted):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def bisect(self, path):
+        '''
+        Where path is, or else where it would be in this order (the end if past every entry).
+        '''
+        entry = self.catalog.paths.bisect(path)
+        if entry == self.catalog.paths.slots:
+            return self.slots
+        return self.seek(entry)
+
+    def index_of(self, path):
+        entry = self.catalog.paths.index_of(path)
+        if entry is None:
+            return None
+        return self.locate(entry)
+
+    def locate(self, entry):
+        '''
+        Index here of a catalog entry, None if not here (or deleted).
+        '''
+        i = self.seek(entry)
+        return i if i < self.slots and self.entries[i] == entry and self.alive[i] else None
+
+    def runs(self):
+        # like PathStore.runs: runs of consecutive entries in the same folder
+        return PathStore.runs_of(map(self.catalog.paths.dirOf.__getitem__, self.entries), self.alive)
+
+    def rank(self, index):
+        return self.alive.count(1, 0, index)
+
+    def compacted(self):
+        return CatalogView(self.catalog, array('I', compress(self.entries, self.alive)), self.sort, self.descending)
+
+
+class Shuffle:
+    '''
+    Visits every number in range(n) once per round, in a random order,
+    without storing the order: a seeded Feistel network permutes a
+    power-of-four range and numbers outside range(n) are walked past
+    (applying the permutation again until one lands inside).
+    A new round starts with a new seed.
+    '''
+    ROUNDS = 4
+
+    def __init__(self, n):
+        self.reset(n)
+
+    def reset(self, n):
+        self.n = n
+        self.pos = 0
+        self.halfBits = 1
+        while (1 << (2*self.halfBits)) < n:
+            self.halfBits += 1
+        self.mask = (1 << self.halfBits) - 1
+        self.keys = [getrandbits(32) for i in range(Shuffle.ROUNDS)]
+
+    def feistel(self, x):
+        left, right = x >> self.halfBits, x & self.mask
+        for key in self.keys:
+            mixed = ((right ^ key) * 0x45d9f3b) & 0xffffffff
+            left, right = right, left ^ ((mixed ^ (mixed >> 16)) & self.mask)
+        return (left << self.halfBits) | right
+
+    def permute(self, i):
+        x = self.feistel(i)
+        while x >= self.n:
+            x = self.feistel(x)
+        return x
+
+    def next(self):
+        if self.n == 0:
+            # (permute would never land inside)
+            raise IndexError('nothing to shuffle')
+        if self.pos >= self.n:
+            # new round
+            self.reset(self.n)
+        x = self.permute(self.pos)
+        self.pos += 1
+        return x
+
+
+class Stopwatch:
+    '''
+    Charges the time between laps (ms) to named stages in timings.
+    Without timings (not tracing), does nothing.
+    '''
+    def __init__(self, timings=None):
+        self.timings = timings
+        if timings is not None:
+            self.last = time.perf_counter()
+
+    def lap(self, stage):
+        if self.timings is not None:
+            now = time.perf_counter()
+            self.timings[stage] = self.timings.get(stage, 0) + (now - self.last) * 1000
+            self.last = now
+
+    def restart(self):
+        '''
+        Start the next lap now (the time since was charged elsewhere).
+        '''
+        if self.timings is not None:
+            self.last = time.perf_counter()
+
+
+class Trace:
+    '''
+    Timings for -v: one JSON line per slide, animation frame or scan,
+    and every TRACE_REPORT slides a line of rolling stats per stage (last TRACE_WINDOW).
+    file is a path to append to, '-' for stdout.
+    '''
+    def __init__(self, file):
+        self.file   = sys.stdout if file == '-' else open(file, 'a', buffering=1)
+        self.recent = {} # 'event.stage' -> deque of ms
+        self.slides = 0
+
+    def write(self, event, timings, **info):
+        '''
+        Record the stage times (ms) of an event.
+        Dicts in info are more stage times, under their own name
+        (like the decode done on a worker thread, 'load').
+        '''
+        record = {'t': round(time.time(), 3), 'event': event}
+        for name, value in info.items():
+            if isinstance(value, dict):
+                self.add(event + '.' + name, value)
+                value = {stage: round(ms, 3) for stage, ms in value.items()}
+            record[name] = value
+        record['ms'] = {stage: round(ms, 3) for stage, ms in timings.items()}
+        record['total'] = round(sum(timings.values()), 3)
+        self.file.write(json.dumps(record, default=str) + '\n')
+        self.add(event, timings)
+        if event == 'slide':
+            self.slides += 1
+            if self.slides % TRACE_REPORT == 0:
+                self.report()
+
+    def add(self, prefix, timings):
+        for stage, ms in timings.items():
+            key = prefix + '.' + stage
+            if key not in self.recent:
+                self.recent[key] = deque(maxlen=TRACE_WINDOW)
+            self.recent[key].append(ms)
+
+    def stats(self):
+        '''
+        {'event.stage': {n, mean, p50, p90, max}} over the recent samples (ms).
+        '''
+        stats = {}
+        for key, samples in self.recent.items():
+            ordered = sorted(samples)
+            n = len(ordered)
+            stats[key] = {
+                'n':    n,
+                'mean': round(sum(ordered) / n, 3),
+                'p50':  round(ordered[n // 2], 3),
+                'p90':  round(ordered[min(n - 1, n * 9 // 10)], 3),
+                'max':  round(ordered[-1], 3),
+            }
+        return stats
+
+    def report(self):
+        record = {'t': round(time.time(), 3), 'event': 'stats', 'slides': self.slides, 'stats': self.stats()}
+        self.file.write(json.dumps(record) + '\n')
+
+    def close(self):
+        if self.recent:
+            self.report()
+        if self.file is sys.stdout:
+            self.file.flush()
+        else:
+            self.file.close()
+
+
+class Deadlines:
+    '''
+    When autoplay's slides are due: delay apart on a fixed timeline, so the time taken
+    to get each one on screen (and animations playing meanwhile) does not add up into drift.
+    The next slide is prepared ahead of its deadline by what preparing has recently cost
+    (90th percentile, see lead), then put on screen on it.
+    '''
+    def __init__(self):
+        self.due    = None # time.perf_counter() the next slide is due
+        self.costs  = deque(maxlen=SCHEDULE_WINDOW) # seconds recent slides took to prepare
+        self.slides = 0
+        self.missed = 0
+
+    def restart(self, delay):
+        '''
+        Due delay (seconds) from now, e.g. after a key press.
+        '''
+        self.due = time.perf_counter() + delay
+
+    def prepared(self, seconds):
+        self.costs.append(seconds)
+
+    def lead(self):
+        '''
+        Seconds before the deadline to start preparing the slide.
+        '''
+        if self.costs:
+            ordered = sorted(self.costs)
+            cost = ordered[len(ordered) * 9 // 10]
+        else:
+            cost = SCHEDULE_LEAD_MS / 1000
+        return cost + SCHEDULE_SLACK_MS / 1000
+
+    def wait_ms(self, lead=0):
+        '''
+        Milliseconds until lead (seconds) before the deadline.
+        '''
+        return max(0, round((self.due - lead - time.perf_counter()) * 1000))
+
+    def shown(self, delay):
+        '''
+        Record the slide that was due going on screen now, and move on to the next deadline.
+        Returns how late it was (seconds, negative if early).
+        '''
+        now = time.perf_counter()
+        late = now - self.due
+        self.slides += 1
+        if late > SCHEDULE_LATE_MS / 1000:
+            self.missed += 1
+        self.due += delay
+        if self.due - self.lead() < now:
+            # the next is out of reach too (a very slow slide, or the machine slept):
+            # start afresh rather than rush through the ones missed
+            self.due = now + delay
+        return late
+
+
+class DecodedImage:
+    '''
+    Everything the slide show needs from an image file, ready to display.
+    '''
+    def __init__(self, path, img, animated, orientation, scaled, full=True, fast=False, pyramid=None):
+        self.path        = path
+        self.img         = img         # oriented image (first frame if animated)
+        self.animated    = animated    # more frames follow, see Animation
+        self.orientation = orientation # EXIF orientation, None if not given
+        self.scaled      = scaled      # img fitted to the requested box, or None
+        self.full        = full        # False if img was decoded at reduced resolution
+        self.fast        = fast        # scaled with a cheap filter, to be replaced (never cached)
+        self.pyramid     = pyramid     # Pyramid to draw from (img is only an overview), or None
+
+    def covers(self, box):
+        '''
+        Whether img has enough pixels to be shown in box (None for 1:1).
+        '''
+        if self.full or self.pyramid:
+            return True
+        if not box:
+            return False
+        fitted = fitSize(self.img.size, box)
+        return fitted[0] <= self.img.size[0] and fitted[1] <= self.img.size[1]
+
+
+def decodeImage(path, box=None, timings=None, fast=False, tiles=None, meta=None):
+    '''
+    Open, orient and fully decode an image.
+    If box (width, height) is given, also scale it to fit,
+    and let the codec skip resolution that would be scaled away (JPEG draft).
+    With fast, make a quick rendition instead: decoded at up to half the resolution (JPEG),
+    scaled cheaply (bilinear, before orienting) and only the scaled image is kept.
+    With tiles (TileStore), very large images are made into a pyramid there instead.
+    With meta (ImageMeta), the header is not read again for orientation and animation
+    (unless the file turns out to have another size, meta is then out of date).
+    If timings (dict) is given, stage times are added to it (see Stopwatch).
+    Safe to call from a worker thread (no Tk).
+    '''
+    clock = Stopwatch(timings)
+    img = openImage(path)
+    fullSize = img.size
+    if meta is not None and (meta.width, meta.height) != fullSize:
+        # file changed since its header was read
+        meta = None
+    clock.lap('open')
+
+    # deal with rotation (and animation, GIF and WebP)
+    if meta is None:
+        orientation = exifOrientation(img)
+        animated = getattr(img, 'is_animated', False)
+    else:
+        orientation = meta.orientation
+        animated = meta.animated
+    clock.lap('exif')
+
+    # very large images are drawn from tiles
+    if tiles and not fast and fullSize[0] * fullSize[1] > PYRAMID_MP * 1000000 and not animated:
+        pyramid = tiles.build(path, img, orientation)
+        clock.lap('pyramid')
+        return pyramid.decoded(box)
+
+    # box in the file's own orientation
+    rawBox = (box[1], box[0]) if box and orientation in (5, 6, 7, 8) else box
+
+    # decode at the smallest power-of-two scale that still covers the box
+    # (must happen before anything loads the pixels)
+    if box and img.format == 'JPEG':
+        draftBox = (rawBox[0] // 2, rawBox[1] // 2) if fast else rawBox
+        img.draft(img.mode, fitSize(img.size, draftBox))
+    full = img.size == fullSize
+
+    # only the first frame of an animation is decoded here
+    if animated:
+        img = img.copy()
+    else:
+        # force the decode here rather than on first use
+        img.load()
+    clock.lap('decode')
+
+    # with the header's size, sizes match however the image was decoded
+    storedSize = (meta.width, meta.height) if meta else img.size
+
+    if fast and box and not animated:
+        # turning the scaled image is cheaper
+        img = img.resize(fitSize(storedSize, rawBox), Image.BILINEAR, reducing_gap=1.0)
+        clock.lap('scale')
+        img = orient(img, orientation)
+        clock.lap('orient')
+        return DecodedImage(path, img, False, orientation, img, full=False, fast=True)
+
+    img = orient(img, orientation)
+    clock.lap('orient')
+
+    # pre-scale for zoomed mode
+    scaled = None
+    if box and not animated:
+        scaled = img.resize(fitSize(meta.size if meta else img.size, box), Image.LANCZOS)
+        clock.lap('scale')
+
+    return DecodedImage(path, img, animated, orientation, scaled, full)
+
+
+# EXIF orientation -> transpose that shows the image upright (1: as stored)
+# https://stackoverflow.com/questions/13872331/rotating-an-image-with-orientation-specified-in-exif-using-python-without-pil-in
+ORIENT_TRANSPOSE = {
+    2: Image.FLIP_LEFT_RIGHT,
+    3: Image.ROTATE_180,
+    4: Image.FLIP_TOP_BOTTOM,
+    5: Image.TRANSPOSE,
+    6: Image.ROTATE_270,
+    7: Image.TRANSVERSE,
+    8: Image.ROTATE_90,
+}
+
+
+def orient(img, orientation):
+    method = ORIENT_TRANSPOSE.get(orientation)
+    if method is not None:
+        img = img.transpose(method)
+    return img
+
+
+class ImageMeta:
+    '''
+    What an image file's header says, read without decoding it:
+    stored size, EXIF orientation (1-8) and number of frames.
+    '''
+    __slots__ = ('width', 'height', 'orientation', 'frames')
+
+    def __init__(self, width, height, orientation=1, frames=1):
+        self.width       = width
+        self.height      = height
+        self.orientation = orientation
+        self.frames      = frames
+
+    @property
+    def size(self):
+        # as shown, after orienting
+        if self.orientation in (5, 6, 7, 8):
+            return (self.height, self.width)
+        return (self.width, self.height)
+
+    @property
+    def animated(self):
+        return self.frames > 1
+
+    def columns(self):
+        return (self.width, self.height, self.orientation, self.frames)
+
+    def fits(self, size):
+        # whether an image decoded from the file (oriented, at any reduced resolution)
+        # could be size, one with a different shape means the file has changed since
+        shown = self.size
+        return abs(shown[0] * size[1] - shown[1] * size[0]) <= max(shown)
+
+
+def exifOrientation(img):
+    '''
+    EXIF orientation (1-8) of an opened image, None if not given.
+    Only looks at what was read with the header
+    (for a PNG, getexif would decode the whole image looking for a late eXIf chunk).
+    '''
+    if img.format == 'PNG':
+        if 'exif' not in img.info:
+            return None
+        exif = Image.Exif()
+        exif.load(img.info['exif'])
+    else:
+        exif = img.getexif()
+    orientation = exif.get(EXIF_ORIENTATION_TAG)
+    return orientation if orientation in ORIENT_TRANSPOSE or orientation == 1 else None
+
+
+def readMeta(path):
+    '''
+    ImageMeta of a file, None if it cannot be read.
+    '''
+    try:
+        with openImage(path) as img:
+            # frames: GIFs are read through (not decoded) to count them
+            return ImageMeta(img.size[0], img.size[1], exifOrientation(img) or 1, getattr(img, 'n_frames', 1))
+    except (OSError, ValueError, EOFError, SyntaxError):
+        return None
+
+
+def scaleDecoded(source, box):
+    '''
+    Reuse an already decoded image for a different box.
+    '''
+    if source.pyramid:
+        return source.pyramid.decoded(box)
+    scaled = None
+    if box and not source.animated:
+        scaled = source.img.resize(fitSize(source.img.size, box), Image.LANCZOS)
+    return DecodedImage(source.path, source.img, source.animated, source.orientation, scaled, source.full)
+
+
+def imageBytes(img):
+    return img.size[0] * img.size[1] * len(img.getbands())
+
+
+def fileMtime(path):
+    stat = fileStat(path)
+    return stat.st_mtime_ns if stat else None
+
+
+def fileStat(path):
+    try:
+        return sourceStat(path)
+    except OSError:
+        return None
+
+
+def sourceStat(path):
+    '''
+    os.stat, of the archive for a file in one.
+    '''
+    member = archiveOf(path)
+    return os.stat(member[0] if member else path)
+
+
+def archiveOf(path):
+    '''
+    (archive, member name) if path is a file inside a ZIP/CBZ archive, otherwise None.
+    '''
+    path = str(path)
+    lower = path.lower()
+    for ext in ARCHIVE_TYPES_LC:
+        end = lower.find(ext + os.sep)
+        while end != -1:
+            end += len(ext)
+            if os.path.isfile(path[:end]):
+                return path[:end], path[end+1:].replace(os.sep, '/')
+            end = lower.find(ext + os.sep, end)
+    return None
+
+
+class Archives:
+    '''
+    ZIP/CBZ archives read as folders: the images in each (listings cached by the archive's mtime)
+    and their bytes, read from the memory-mapped archive.
+    The most recently used archives are kept open, closed before they are replaced or deleted.
+    Thread safe.
+    '''
+    class Mapping(mmap.mmap):
+        # what ZipFile asks of a file (mmap has it from Python 3.13)
+        def seekable(self):
+            return True
+
+    def __init__(self, maxopen=ARCHIVES_OPEN):
+        self.maxopen  = maxopen
+        self.open     = OrderedDict() # archive -> (mtime, file, mmap, ZipFile)
+        self.listings = {}            # archive -> (mtime, [(member name, size)])
+        self.lock     = threading.Lock()
+
+    def zip(self, archive, mtime):
+        # (lock held)
+        entry = self.open.get(archive)
+        if entry and entry[0] == mtime:
+            self.open.move_to_end(archive)
+            return entry[3]
+        if entry:
+            self.close_entry(self.open.pop(archive))
+        file = open(archive, 'rb')
+        try:
+            # central directory and members are read from the mapping, the OS pages in what is used
+            data = self.Mapping(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty
+            file.close()
+            raise zipfile.BadZipFile(archive)
+        try:
+            zf = zipfile.ZipFile(data)
+        except:
+            data.close()
+            file.close()
+            raise
+        self.open[archive] = (mtime, file, data, zf)
+        while len(self.open) > self.maxopen:
+            self.close_entry(self.open.popitem(last=False)[1])
+        return zf
+
+    @staticmethod
+    def close_entry(entry):
+        mtime, file, data, zf = entry
+        zf.close()
+        data.close()
+        file.close()
+
+    def listing(self, archive):
+        '''
+        [(member name, size)] of the images in archive, in archive order.
+        '''
+        mtime = os.stat(archive).st_mtime_ns
+        with self.lock:
+            cached = self.listings.get(archive)
+            if cached and cached[0] == mtime:
+                return cached[1]
+            try:
+                infos = self.zip(archive, mtime).infolist()
+            except zipfile.BadZipFile as e:
+                raise OSError(e)
+            members = [(info.filename, info.file_size) for info in infos
+                       if not info.is_dir() and Scanner.is_image(info.filename)]
+            self.listings[archive] = (mtime, members)
+            return members
+
+    def read(self, archive, member):
+        '''
+        The bytes of member.
+        '''
+        mtime = os.stat(archive).st_mtime_ns
+        # (read under the lock: an archive is never closed under a reader)
+        with self.lock:
+            try:
+                return self.zip(archive, mtime).read(member)
+            except (zipfile.BadZipFile, KeyError) as e:
+                raise OSError(e)
+
+    def forget(self, path):
+        '''
+        Close archives at or under path, before it is deleted.
+        '''
+        path = str(path)
+        prefix = path + os.sep
+        with self.lock:
+            for archive in list(self.open):
+                if archive == path or archive.startswith(prefix):
+                    self.close_entry(self.open.pop(archive))
+            for archive in list(self.listings):
+                if archive == path or archive.startswith(prefix):
+                    del self.listings[archive]
+
+    def close(self):
+        with self.lock:
+            self.listings.clear()
+            for entry in self.open.values():
+                self.close_entry(entry)
+            self.open.clear()
+
+
+ARCHIVES = Archives() # one per process, shared by every reader
+
+
+def openImage(path):
+    '''
+    Image.open, also for files inside archives.
+    '''
+    member = archiveOf(path)
+    if member is None:
+        return Image.open(path)
+    return Image.open(io.BytesIO(ARCHIVES.read(*member)))
+
+
+class ImageCache:
+    '''
+    Decoded images, least recently used dropped first once over budget.
+    Keyed by (path, mtime, box) so a changed file never matches.
+    Thread safe.
+    '''
+    def __init__(self, maxbytes):
+        self.maxbytes = maxbytes
+        self.nbytes   = 0
+        self.entries  = OrderedDict() # (path, mtime, box) -> (DecodedImage, bytes)
+        self.lock     = threading.Lock()
+
+    @staticmethod
+    def sizeof(decoded):
+        # shared images are counted per entry, which only errs on the safe side
+        nbytes = imageBytes(decoded.img)
+        if decoded.scaled is not None:
+            nbytes += imageBytes(decoded.scaled)
+        return nbytes
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def get_source(self, path, mtime, box):
+        '''
+        Any entry for this version of the file that has enough pixels for box,
+        whatever box it was scaled to.
+        '''
+        with self.lock:
+            for key, entry in reversed(self.entries.items()):
+                if key[0] == path and key[1] == mtime and entry[0].covers(box):
+                    self.entries.move_to_end(key)
+                    return entry[0]
+        return None
+
+    def put(self, key, decoded):
+        nbytes = self.sizeof(decoded)
+        if nbytes > self.maxbytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self.entries[key] = (decoded, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.maxbytes:
+                _, old = self.entries.popitem(last=False)
+                self.nbytes -= old[1]
+
+    def invalidate(self, path):
+        '''
+        Drop a file, or everything under a folder.
+        '''
+        path = Path(path)
+        with self.lock:
+            for key in list(self.entries):
+                if key[0] == path or path in key[0].parents:
+                    self.nbytes -= self.entries.pop(key)[1]
+
+    def validate(self):
+        '''
+        Drop entries whose file has changed or is gone.
+        '''
+        with self.lock:
+            keys = list(self.entries)
+        for key in keys:
+            if fileMtime(key[0]) != key[1]:
+                with self.lock:
+                    entry = self.entries.pop(key, None)
+                    if entry is not None:
+                        self.nbytes -= entry[1]
+
+
+class PreviewCache:
+    '''
+    Oriented, window-sized renditions of images, saved on disk between runs.
+    One per file, named by a hash of its path, mtime and size,
+    and replaced by a bigger one if a bigger window needs it.
+    Least recently used previews are pruned once over budget.
+    Thread safe.
+    '''
+    def __init__(self, maxbytes, dir=PREVIEW_DIR):
+        self.dir      = Path(dir)
+        self.maxbytes = maxbytes
+        self.written  = 0 # bytes since the last prune
+        self.lock     = threading.Lock()
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+    def files(self, path, stat):
+        key = '{}|{}|{}'.format(path, stat.st_mtime_ns, stat.st_size)
+        name = hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()
+        # JPEG unless the preview needs transparency
+        return self.dir / (name + '.jpg'), self.dir / (name + '.png')
+
+    def get(self, path, stat, box):
+        '''
+        The preview, if there is one with enough pixels for box.
+        '''
+        for file in self.files(path, stat):
+            try:
+                img = Image.open(file)
+            except OSError:
+                continue
+            fitted = fitSize(img.size, box)
+            if fitted[0] > img.size[0] or fitted[1] > img.size[1]:
+                img.close()
+                return None
+            img.load()
+            try:
+                # mtime marks use, for pruning
+                os.utime(file)
+            except OSError:
+                pass
+            return img
+        return None
+
+    def put(self, path, stat, img):
+        jpg, png = self.files(path, stat)
+        if img.mode in ('RGB', 'L'):
+            file, other = jpg, png
+        else:
+            file, other = png, jpg
+            if img.mode not in ('RGBA', 'LA'):
+                img = img.convert('RGBA')
+        # write then rename, so a reader never sees half a file
+        temp = file.with_name(file.name + '.{}.tmp'.format(threading.get_ident()))
+        try:
+            if file is jpg:
+                img.save(temp, 'JPEG', quality=90)
+            else:
+                img.save(temp, 'PNG', compress_level=1)
+            os.replace(temp, file)
+            if other.exists():
+                other.unlink()
+        except OSError:
+            try:
+                temp.unlink()
+            except OSError:
+                pass
+            return
+        with self.lock:
+            self.written += file.stat().st_size
+            prune = self.written > self.maxbytes // 10
+            if prune:
+                self.written = 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        entries = []
+        for entry in os.scandir(self.dir):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(e[1] for e in entries)
+        entries.sort()
+        for mtime, size, file in entries:
+            if total <= self.maxbytes:
+                break
+            try:
+                os.remove(file)
+                total -= size
+            except OSError:
+                pass
+
+
+class TileStore:
+    '''
+    Tiled pyramids of very large images, made once and kept on disk between runs,
+    with the most recently used tiles kept decoded in memory (up to maxbytes).
+    One folder per file, named like previews. A pyramid is complete once its meta.json is written.
+    Least recently used pyramids are pruned once over diskbytes.
+    Thread safe.
+    '''
+    def __init__(self, maxbytes=TILE_MB*1024*1024, diskbytes=PYRAMID_MB*1024*1024, dir=PYRAMID_DIR):
+        self.dir       = Path(dir)
+        self.maxbytes  = maxbytes
+        self.diskbytes = diskbytes
+        self.tiles     = OrderedDict() # (folder, level, col, row) -> (image, bytes)
+        self.nbytes    = 0
+        self.lock      = threading.Lock()
+        self.building  = {} # folder -> lock held while it is made
+
+    def folder(self, path, stat):
+        key = '{}|{}|{}'.format(path, stat.st_mtime_ns, stat.st_size)
+        return self.dir / hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()
+
+    def find(self, path, stat):
+        '''
+        The pyramid of this version of the file, if it has been made.
+        '''
+        folder = self.folder(path, stat)
+        try:
+            with open(folder / 'meta.json') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        try:
+            # mtime marks use, for pruning
+            os.utime(folder)
+        except OSError:
+            pass
+        return Pyramid(self, path, folder, meta)
+
+    def build(self, path, img, orientation):
+        '''
+        Make the pyramid of an opened (not yet loaded) image, unless made already.
+        Needs the whole image decoded once, memory is bounded after that.
+        '''
+        stat = sourceStat(path)
+        folder = self.folder(path, stat)
+        with self.lock:
+            lock = self.building.setdefault(folder, threading.Lock())
+        with lock:
+            pyramid = self.find(path, stat)
+            if pyramid is None:
+                pyramid = self.make(path, folder, img, orientation)
+        with self.lock:
+            self.building.pop(folder, None)
+        self.prune()
+        return pyramid
+
+    def make(self, path, folder, img, orientation):
+        img = orient(img, orientation)
+        if 'A' in img.getbands() or 'transparency' in img.info:
+            mode, ext = 'RGBA', '.png'
+        else:
+            mode, ext = ('L', '.jpg') if img.mode in ('1', 'L') else ('RGB', '.jpg')
+        if img.mode != mode:
+            img = img.convert(mode)
+        # anything left from an earlier try
+        shutil.rmtree(folder, ignore_errors=True)
+        folder.mkdir(parents=True)
+        sizes = []
+        while True:
+            level = len(sizes)
+            sizes.append(img.size)
+            for row in range(math.ceil(img.size[1] / TILE_SIZE)):
+                for col in range(math.ceil(img.size[0] / TILE_SIZE)):
+                    tile = img.crop((col*TILE_SIZE, row*TILE_SIZE,
+                                     min((col+1)*TILE_SIZE, img.size[0]), min((row+1)*TILE_SIZE, img.size[1])))
+                    file = folder / '{}_{}_{}{}'.format(level, col, row, ext)
+                    if ext == '.jpg':
+                        tile.save(file, 'JPEG', quality=95)
+                    else:
+                        tile.save(file, 'PNG', compress_level=1)
+            if img.size[0] <= TILE_SIZE and img.size[1] <= TILE_SIZE:
+                break
+            # halve (box filter) for the next level
+            img = img.reduce(2)
+        meta = {'levels': sizes, 'mode': mode, 'ext': ext, 'tile': TILE_SIZE}
+        temp = folder / 'meta.json.tmp'
+        with open(temp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(temp, folder / 'meta.json')
+        return Pyramid(self, path, folder, meta)
+
+    def tile(self, folder, level, col, row, ext):
+        key = (folder, level, col, row)
+        with self.lock:
+            entry = self.tiles.get(key)
+            if entry is not None:
+                self.tiles.move_to_end(key)
+                return entry[0]
+        img = Image.open(folder / '{}_{}_{}{}'.format(level, col, row, ext))
+        img.load()
+        nbytes = imageBytes(img)
+        with self.lock:
+            self.tiles[key] = (img, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.maxbytes and len(self.tiles) > 1:
+                _, old = self.tiles.popitem(last=False)
+                self.nbytes -= old[1]
+        return img
+
+    def prune(self):
+        if not self.dir.is_dir():
+            return
+        entries = []
+        for entry in os.scandir(self.dir):
+            try:
+                mtime = entry.stat().st_mtime
+                size = sum(file.stat().st_size for file in os.scandir(entry.path))
+            except OSError:
+                continue
+            entries.append((mtime, size, entry.path))
+        total = sum(e[1] for e in entries)
+        entries.sort()
+        for mtime, size, folder in entries:
+            if total <= self.diskbytes:
+                break
+            with self.lock:
+                if Path(folder) in self.building:
+                    continue
+            shutil.rmtree(folder, ignore_errors=True)
+            total -= size
+
+
+class Pyramid:
+    '''
+    An image in a TileStore: any part of it drawn at any scale,
+    from the tiles of the level with the fewest pixels that still has enough.
+    Level 0 is the full (oriented) image, each level after it half the size.
+    '''
+    def __init__(self, store, path, folder, meta):
+        self.store  = store
+        self.path   = path
+        self.folder = folder
+        self.sizes  = [tuple(size) for size in meta['levels']]
+        self.size   = self.sizes[0]
+        self.mode   = meta['mode']
+        self.ext    = meta['ext']
+        self.tile   = meta['tile']
+
+    def level(self, scale):
+        level = 0
+        while level + 1 < len(self.sizes) and scale <= 0.5 ** (level + 1):
+            level += 1
+        return level
+
+    def fitScale(self, box):
+        return min(box[0] / self.size[0], box[1] / self.size[1])
+
+    def render(self, center, scale, out):
+        '''
+        Image of size out (width, height) showing the image at scale (screen pixels per image pixel),
+        with center (image pixels) in the middle. Outside the image is transparent (or #202020).
+        '''
+        background = (0, 0, 0, 0) if self.mode == 'RGBA' else 0x20 if self.mode == 'L' else (0x20, 0x20, 0x20)
+        screen = Image.new(self.mode, out, background)
+        level = self.level(scale)
+        levelScale = 0.5 ** level
+        width, height = self.sizes[level]
+        # screen pixels per level pixel
+        zoom = scale / levelScale
+        # the view, in level pixels
+        x0 = center[0] * levelScale - out[0] / 2 / zoom
+        y0 = center[1] * levelScale - out[1] / 2 / zoom
+        x1 = x0 + out[0] / zoom
+        y1 = y0 + out[1] / zoom
+        # the part of it with image in it
+        vx0, vy0 = max(x0, 0), max(y0, 0)
+        vx1, vy1 = min(x1, width), min(y1, height)
+        if vx0 >= vx1 or vy0 >= vy1:
+            return screen
+        # the tiles under it, put together
+        t = self.tile
+        cols = range(int(vx0) // t, (math.ceil(vx1) - 1) // t + 1)
+        rows = range(int(vy0) // t, (math.ceil(vy1) - 1) // t + 1)
+        left, top = cols[0] * t, rows[0] * t
+        region = Image.new(self.mode, (min(cols[-1]*t + t, width) - left, min(rows[-1]*t + t, height) - top))
+        for row in rows:
+            for col in cols:
+                region.paste(self.store.tile(self.folder, level, col, row, self.ext), (col*t - left, row*t - top))
+        # onto the screen
+        sx0, sy0 = round((vx0 - x0) * zoom), round((vy0 - y0) * zoom)
+        size = (max(1, min(round((vx1 - x0) * zoom), out[0]) - sx0),
+                max(1, min(round((vy1 - y0) * zoom), out[1]) - sy0))
+        # beyond 1:1, show the pixels
+        resample = Image.NEAREST if zoom > 1 else Image.BILINEAR
+        region = region.resize(size, resample, box=(vx0 - left, vy0 - top, vx1 - left, vy1 - top))
+        screen.paste(region, (sx0, sy0))
+        return screen
+
+    def decoded(self, box=None):
+        '''
+        A DecodedImage for the slide show, with an overview that fits box
+        (or the smallest level) as its image.
+        '''
+        if box:
+            img = self.render((self.size[0] / 2, self.size[1] / 2), self.fitScale(box), fitSize(self.size, box))
+            return DecodedImage(self.path, img, False, None, img, full=False, pyramid=self)
+        img = self.store.tile(self.folder, len(self.sizes) - 1, 0, 0, self.ext)
+        return DecodedImage(self.path, img, False, None, None, full=False, pyramid=self)
+
+
+class Animation:
+    '''
+    Frames of an animated GIF/WebP, decoded as they are played.
+    Keeps the most recent frames and scaled Tk photos, both bounded.
+    Only call from the Tk thread.
+    '''
+    def __init__(self, decoded, makePhoto=ImageTk.PhotoImage):
+        self.makePhoto   = makePhoto
+        self.path        = decoded.path
+        self.orientation = decoded.orientation
+        self.img         = openImage(self.path)
+        self.index       = 0
+        self.count       = None          # number of frames, known after the first pass
+        self.frames      = OrderedDict() # index -> (oriented frame, duration ms)
+        self.photos      = OrderedDict() # (index, size) -> (PhotoImage, bytes)
+        self.photoBytes  = 0
+        self.frames[0] = (decoded.img, self.duration(decoded.img))
+
+    @staticmethod
+    def duration(frame):
+        # per-frame, only known once the frame is loaded
+        duration = frame.info.get('duration') or 0
+        if duration < ANIM_MIN_DELAY_MS:
+            duration = ANIM_DEFAULT_MS
+        return int(duration)
+
+    def frame(self, index):
+        '''
+        Get (frame, duration), decoding it if it has left the buffer.
+        Raises EOFError past the last frame.
+        '''
+        entry = self.frames.get(index)
+        if entry is not None:
+            self.frames.move_to_end(index)
+            return entry
+        self.img.seek(index)
+        frame = self.img.copy()
+        entry = (orient(frame, self.orientation), self.duration(frame))
+        self.frames[index] = entry
+        while len(self.frames) > ANIM_BUFFER_FRAMES:
+            self.frames.popitem(last=False)
+        return entry
+
+    def advance(self):
+        index = self.index + 1
+        if index == self.count:
+            index = 0
+        try:
+            self.frame(index)
+        except EOFError:
+            # first time past the end
+            self.count = index
+            index = 0
+        self.index = index
+
+    def delay(self):
+        return self.frame(self.index)[1]
+
+    def size(self):
+        return self.frames[0][0].size
+
+    def photo(self, size=None):
+        '''
+        Current frame as a Tk photo, scaled to size if given.
+        '''
+        key = (self.index, size)
+        entry = self.photos.get(key)
+        if entry is not None:
+            self.photos.move_to_end(key)
+            return entry[0]
+        frame = self.frame(self.index)[0]
+        if size:
+            frame = frame.resize(size, Image.LANCZOS)
+        photo = self.makePhoto(frame)
+        nbytes = frame.size[0] * frame.size[1] * 4
+        self.photos[key] = (photo, nbytes)
+        self.photoBytes += nbytes
+        while self.photoBytes > ANIM_PHOTO_MB*1024*1024 and len(self.photos) > 1:
+            _, old = self.photos.popitem(last=False)
+            self.photoBytes -= old[1]
+        return photo
+
+    def close(self):
+        self.photos = OrderedDict()
+        self.frames = OrderedDict()
+        self.img.close()
+
+
+class PhotoBuffers:
+    '''
+    Tk photos that stills are drawn into in place, instead of a new photo per slide.
+    Kept per size and mode, for the PHOTO_SIZES used last (photos from one camera all fit
+    the window at the same size, pyramid views are always the window size).
+    Two of each, so the next slide can be drawn into one (see Deadlines) while the other is on screen
+    (a third if the slide on screen is drawn again before the next goes up).
+    Only call from the Tk thread.
+    '''
+    def __init__(self, sizes=PHOTO_SIZES):
+        self.sizes   = sizes
+        self.buffers = OrderedDict() # (size, mode) -> [PhotoImage]
+
+    @staticmethod
+    def mode(img):
+        # what Tk photos take
+        if img.mode in ('L', 'RGB', 'RGBA'):
+            return img.mode
+        if img.mode in ('LA', 'PA') or 'transparency' in img.info:
+            return 'RGBA'
+        return 'RGB'
+
+    def photo(self, img, keep=()):
+        '''
+        A photo of img, other than those in keep (the photo on screen, and the next one's).
+        '''
+        mode = self.mode(img)
+        if img.mode != mode:
+            # (convert applies palettes and transparency)
+            img = img.convert(mode)
+        key = (img.size, mode)
+        photos = self.buffers.pop(key, [])
+        self.buffers[key] = photos
+        while len(self.buffers) > self.sizes:
+            self.buffers.popitem(last=False)
+        for photo in photos:
+            if not any(photo is kept for kept in keep):
+                break
+        else:
+            photo = ImageTk.PhotoImage(mode, img.size)
+            photos.append(photo)
+        photo.paste(img)
+        return photo
+
+    def close(self):
+        self.buffers.clear()
+
+
+class LibraryIndex:
+    '''
+    SQLite record of scanned directories: subdirectories and image files
+    (with mtime, size and, once read, ImageMeta), stored with the directory's mtime.
+    A directory whose mtime has not changed need not be listed again.
+    Thread safe.
+    '''
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS dirs (
+                path    TEXT PRIMARY KEY,
+                mtime   INTEGER,
+                subdirs TEXT
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                path        TEXT PRIMARY KEY,
+                dir         TEXT,
+                name        TEXT,
+                ext         TEXT,
+                mtime       INTEGER,
+                size        INTEGER,
+                width       INTEGER,
+                height      INTEGER,
+                orientation INTEGER,
+                frames      INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+        ''')
+        # indexes made before the header columns
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(files)')]
+        for column in ('width', 'height', 'orientation', 'frames'):
+            if column not in columns:
+                self.db.execute(f'ALTER TABLE files ADD COLUMN {column} INTEGER')
+
+    def listing(self, dir, mtime):
+        '''
+        (subdirectory names, [(image path, mtime, size, ImageMeta or None)]) as stored for dir,
+        None if not stored or stored at a different mtime.
+        '''
+        with self.lock:
+            if self.db is None:
+                return None
+            row = self.db.execute('SELECT mtime, subdirs FROM dirs WHERE path = ?', (dir,)).fetchone()
+            if row is None or row[0] != mtime:
+                return None
+            files = [r[:3] + (ImageMeta(*r[3:]) if r[3] is not None else None,) for r in
+                     self.db.execute('SELECT path, mtime, size, width, height, orientation, frames '
+                                     'FROM files WHERE dir = ?', (dir,))]
+        return json.loads(row[1]), files
+
+    def folder(self, dir):
+        '''
+        (mtime, subdirectory names, image paths) as stored for dir, whatever its mtime now,
+        None if not stored.
+        '''
+        with self.lock:
+            if self.db is None:
+                return None
+            row = self.db.execute('SELECT mtime, subdirs FROM dirs WHERE path = ?', (dir,)).fetchone()
+            if row is None:
+                return None
+            files = [r[0] for r in self.db.execute('SELECT path FROM files WHERE dir = ?', (dir,))]
+        return row[0], json.loads(row[1]), files
+
+    def store(self, dir, mtime, subdirs, files):
+        '''
+        Replace the listing of dir.
+        files is a list of (path, name, ext, mtime, size, ImageMeta or None).
+        '''
+        with self.lock:
+            if self.db is None:
+                return
+            # forget subdirectories that are gone, and everything below them
+            row = self.db.execute('SELECT subdirs FROM dirs WHERE path = ?', (dir,)).fetchone()
+            if row is not None:
+                for name in set(json.loads(row[0])) - set(subdirs):
+                    self.forget(os.path.join(dir, name))
+            self.db.execute('DELETE FROM files WHERE dir = ?', (dir,))
+            self.db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                [(f[0], dir) + tuple(f[1:5]) + (f[5].columns() if f[5] else (None,) * 4)
+                                 for f in files])
+            self.db.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)',
+                            (dir, mtime, json.dumps(subdirs)))
+
+    def stats(self):
+        '''
+        {path: (mtime, size)} of every file stored.
+        '''
+        with self.lock:
+            if self.db is None:
+                return {}
+            return {row[0]: (row[1], row[2]) for row in self.db.execute('SELECT path, mtime, size FROM files')}
+
+    def store_meta(self, files):
+        '''
+        Add headers read since the listing was stored,
+        files is a list of (path, mtime, size, ImageMeta or None),
+        mtime and size None where the file has not changed since.
+        '''
+        with self.lock:
+            if self.db is None:
+                return
+            self.db.executemany('UPDATE files SET mtime = COALESCE(?, mtime), size = COALESCE(?, size), '
+                                'width = ?, height = ?, orientation = ?, frames = ? WHERE path = ?',
+                                [(mtime, size) + (meta.columns() if meta else (None,) * 4) + (path,)
+                                 for path, mtime, size, meta in files])
+
+    def forget(self, dir):
+        # caller holds the lock
+        lo = dir + os.sep
+        hi = dir + chr(ord(os.sep) + 1)
+        for table, column in (('dirs', 'path'), ('files', 'dir')):
+            self.db.execute(f'DELETE FROM {table} WHERE {column} = ? OR ({column} >= ? AND {column} < ?)',
+                            (dir, lo, hi))
+
+    def commit(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.commit()
+
+    def close(self):
+        # scan workers may still be finishing, they find the index closed
+        with self.lock:
+            if self.db is not None:
+                self.db.commit()
+                self.db.close()
+                self.db = None
+
+
+class Scanner:
+    '''
+    Lists directories on worker threads with os.scandir
+    and streams matching image paths back in batches.
+    Like pathlib's ** glob, symlinked directories are not followed.
+    ZIP/CBZ archives are listed like subdirectories, their images found under the archive's path.
+    With an index, directories that have not changed are read from it instead.
+    With meta (a dict), the ImageMeta of each image found is put in it by path (headers only),
+    from the index when it has them.
+    '''
+    def __init__(self, roots, recurse, pattern, index=None, workers=SCAN_WORKERS, meta=None):
+        self.recurse   = recurse
+        self.pattern   = pattern
+        self.index     = index
+        self.meta      = meta
+        self.executor  = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='meh-scan')
+        self.results   = queue.Queue() # lists of paths, one per directory
+        self.pending   = 0
+        self.lock      = threading.Lock()
+        self.finished  = threading.Event()
+        self.cancelled = False
+        self.started   = time.perf_counter()
+        self.elapsed   = None # seconds the scan took, once finished
+        for root in dict.fromkeys(roots):
+            self.submit(root)
+        if not self.pending:
+            self.elapsed = 0
+            self.finished.set()
+
+    @staticmethod
+    def is_image(path):
+        return os.path.splitext(path)[1].lower() in SlideShow.FILE_TYPES_LC
+
+    @staticmethod
+    def is_archive(path):
+        return os.path.splitext(path)[1].lower() in ARCHIVE_TYPES_LC
+
+    def matches(self, path):
+        return self.is_image(path) and self.pattern.search(path) is not None
+
+    def submit(self, dir):
+        with self.lock:
+            self.pending += 1
+        try:
+            self.executor.submit(self.scan, dir)
+        except RuntimeError:
+            # closed
+            self.done_one()
+
+    def done_one(self):
+        with self.lock:
+            self.pending -= 1
+            if self.pending == 0:
+                if self.index:
+                    self.index.commit()
+                self.elapsed = time.perf_counter() - self.started
+                self.finished.set()
+
+    def scan(self, dir):
+        found = []
+        try:
+            if self.cancelled:
+                return
+            if self.index:
+                # stat before listing, so a change during the listing is seen next time
+                mtime = os.stat(dir).st_mtime_ns
+                listing = self.index.listing(dir, mtime)
+                if listing is not None:
+                    subdirs, files = listing
+                    if self.recurse:
+                        for name in subdirs:
+                            self.submit(os.path.join(dir, name))
+                    read = []
+                    # a file rewritten in place leaves its folder's mtime alone,
+                    # headers are only trusted while the file's own mtime and size match
+                    # (an archive's members change with the archive)
+                    check = self.meta is not None and not self.is_archive(dir)
+                    for path, mtime, size, meta in files:
+                        if self.pattern.search(path) is None:
+                            continue
+                        found.append(Path(path))
+                        if self.meta is not None:
+                            changed = None
+                            if check:
+                                try:
+                                    stat = os.stat(path)
+                                    if (stat.st_mtime_ns, stat.st_size) != (mtime, size):
+                                        changed = (stat.st_mtime_ns, stat.st_size)
+                                        meta = None
+                                except OSError:
+                                    pass
+                            if meta is None:
+                                meta = readMeta(path)
+                                if changed or meta is not None:
+                                    read.append((path,) + (changed or (None, None)) + (meta,))
+                            self.meta[found[-1]] = meta
+                    if read:
+                        self.index.store_meta(read)
+                    return
+            subdirs = []
+            files = []
+            if self.is_archive(dir) and os.path.isfile(dir):
+                self.scan_archive(dir, found, files)
+                if self.index:
+                    self.index.store(dir, mtime, subdirs, files)
+                return
+            with os.scandir(dir) as entries:
+                for entry in entries:
+                    try:
+                        # use the type info that came with the listing, no extra stat
+                        if entry.is_dir():
+                            if not entry.is_symlink():
+                                subdirs.append(entry.name)
+                                if self.recurse:
+                                    self.submit(entry.path)
+                        elif self.is_archive(entry.path) and entry.is_file():
+                            # a folder of its own, like a subdirectory
+                            subdirs.append(entry.name)
+                            if self.recurse:
+                                self.submit(entry.path)
+                        elif entry.is_file() and self.is_image(entry.path):
+                            path = Path(entry.path)
+                            if entry.is_symlink():
+                                path = path.resolve()
+                            meta = None
+                            if self.pattern.search(entry.path) is not None:
+                                found.append(path)
+                                if self.meta is not None:
+                                    meta = self.meta[path] = readMeta(path)
+                            if self.index:
+                                stat = entry.stat()
+                                files.append((str(path), entry.name, path.suffix.lower(), stat.st_mtime_ns, stat.st_size, meta))
+                    except OSError:
+                        pass
+            if self.index:
+                self.index.store(dir, mtime, subdirs, files)
+        except OSError:
+            # unreadable directory, skip it like glob does
+            pass
+        finally:
+            # results go out before the count so done() implies all are queued
+            if found:
+                self.results.put(found)
+            self.done_one()
+
+    def scan_archive(self, archive, found, files):
+        # its images, from the central directory (subfolders in it are folders of their own)
+        stat = None
+        for name, size in ARCHIVES.listing(archive):
+            path = Path(archive, name)
+            meta = None
+            if self.pattern.search(str(path)) is not None:
+                found.append(path)
+                if self.meta is not None:
+                    meta = self.meta[path] = readMeta(path)
+            if self.index:
+                stat = stat or os.stat(archive)
+                files.append((str(path), path.name, path.suffix.lower(), stat.st_mtime_ns, size, meta))
+
+    def done(self):
+        return self.finished.is_set()
+
+    def poll(self):
+        '''
+        All paths found since the last call, without waiting.
+        '''
+        found = []
+        while True:
+            try:
+                found += self.results.get_nowait()
+            except queue.Empty:
+                return found
+
+    def wait(self):
+        '''
+        All remaining paths, once the scan is done.
+        '''
+        self.finished.wait()
+        return self.poll()
+
+    def wait_any(self):
+        '''
+        Wait until something is found or the scan is done.
+        '''
+        while not self.done():
+            try:
+                return self.results.get(timeout=0.05) + self.poll()
+            except queue.Empty:
+                pass
+        return self.poll()
+
+    def close(self):
+        self.cancelled = True
+        self.executor.shutdown(wait=False)
+
+
+class Watcher:
+    '''
+    Reports images added to or removed from the scanned folders.
+    Uses watchdog (inotify, ReadDirectoryChangesW, ...) if it is installed,
+    otherwise rescans every WATCH_SCAN_S seconds, listing only folders that changed.
+    '''
+    def __init__(self, roots, recurse, pattern, index=None):
+        self.roots   = roots
+        self.recurse = recurse
+        self.pattern = pattern
+        self.index   = index
+        self.changes = queue.Queue() # (added, removed, removed dirs)
+        self.stopped = threading.Event()
+        self.observer = None
+        try:
+            self.start_observer()
+        except ImportError:
+            self.thread = threading.Thread(target=self.rescan_loop, name='meh-watch', daemon=True)
+            self.thread.start()
+
+    def start_observer(self):
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+
+        watcher = self
+        class Handler(FileSystemEventHandler):
+            def on_created(self, event):
+                watcher.created(event.src_path, event.is_directory)
+            def on_deleted(self, event):
+                watcher.deleted(event.src_path, event.is_directory)
+            def on_moved(self, event):
+                watcher.deleted(event.src_path, event.is_directory)
+                watcher.created(event.dest_path, event.is_directory)
+
+        self.observer = Observer()
+        for root in dict.fromkeys(self.roots):
+            self.observer.schedule(Handler(), root, recursive=self.recurse)
+        self.observer.daemon = True
+        self.observer.start()
+
+    def created(self, path, is_dir):
+        if is_dir:
+            # moved in with its contents, or new and (nearly) empty
+            if self.recurse:
+                scanner = Scanner([path], True, self.pattern)
+                self.changes.put((scanner.wait(), [], []))
+                scanner.close()
+        elif Scanner.is_image(path) and self.pattern.search(path) is not None:
+            self.changes.put(([Path(path)], [], []))
+        elif Scanner.is_archive(path) and self.recurse:
+            scanner = Scanner([path], True, self.pattern)
+            self.changes.put((scanner.wait(), [], []))
+            scanner.close()
+
+    def deleted(self, path, is_dir):
+        # (an archive goes with the images in it)
+        if is_dir or Scanner.is_archive(path):
+            self.changes.put(([], [], [Path(path)]))
+        else:
+            self.changes.put(([], [Path(path)], []))
+
+    def rescan_loop(self):
+        # a first scan puts every folder in the index, then each pass costs one stat per folder:
+        # only folders whose mtime changed are listed again, and diffed with what the index had
+        index = self.index or LibraryIndex(':memory:')
+        scanner = Scanner(self.roots, self.recurse, self.pattern, index)
+        scanner.wait()
+        scanner.close()
+        folders = {} # dir -> (mtime, subdirectory names) as last listed
+        for root in dict.fromkeys(self.roots):
+            self.remember(root, index, folders)
+        while not self.stopped.wait(WATCH_SCAN_S):
+            added, removed, removedDirs = [], [], []
+            for root in dict.fromkeys(self.roots):
+                self.check(root, index, folders, added, removed, removedDirs)
+            if added or removed or removedDirs:
+                self.changes.put((added, removed, removedDirs))
+        if index is not self.index:
+            index.close()
+
+    def remember(self, dir, index, folders):
+        # folders[dir], and the folders below it, as the index has them
+        stack = [dir]
+        while stack:
+            dir = stack.pop()
+            stored = index.folder(dir)
+            if stored is None:
+                continue
+            folders[dir] = stored[:2]
+            if self.recurse:
+                stack += [os.path.join(dir, name) for name in stored[1]]
+
+    def check(self, dir, index, folders, added, removed, removedDirs):
+        '''
+        Add what changed in dir (and below) to the lists, listing only folders whose mtime changed.
+        '''
+        stack = [dir]
+        while stack and not self.stopped.is_set():
+            dir = stack.pop()
+            try:
+                mtime = os.stat(dir).st_mtime_ns
+            except OSError:
+                # gone, its parent reports it
+                continue
+            known, subdirs = folders.get(dir, (None, []))
+            if mtime != known:
+                before = index.folder(dir)
+                scanner = Scanner([dir], False, self.pattern, index)
+                found = set(map(str, scanner.wait()))
+                scanner.close()
+                after = index.folder(dir)
+                if after is None:
+                    # unreadable
+                    continue
+                files = {path for path in before[2] if self.pattern.search(path) is not None} if before else set()
+                added += [Path(path) for path in found - files]
+                removed += [Path(path) for path in files - found]
+                folders[dir] = after[:2]
+                if self.recurse:
+                    for name in set(subdirs) - set(after[1]):
+                        gone = os.path.join(dir, name)
+                        removedDirs.append(Path(gone))
+                        for key in [key for key in folders if key == gone or key.startswith(gone + os.sep)]:
+                            del folders[key]
+                    for name in set(after[1]) - set(subdirs):
+                        new = os.path.join(dir, name)
+                        scanner = Scanner([new], True, self.pattern, index)
+                        added += scanner.wait()
+                        scanner.close()
+                        self.remember(new, index, folders)
+                subdirs = [name for name in after[1] if name in subdirs]
+            if self.recurse:
+                stack += [os.path.join(dir, name) for name in subdirs]
+
+    def poll(self):
+        '''
+        (added, removed, removed dirs) since the last call, without waiting.
+        '''
+        added, removed, removedDirs = [], [], []
+        while True:
+            try:
+                change = self.changes.get_nowait()
+            except queue.Empty:
+                return added, removed, removedDirs
+            added += change[0]
+            removed += change[1]
+            removedDirs += change[2]
+
+    def close(self):
+        self.stopped.set()
+        if self.observer:
+            self.observer.stop()
+
+
+def decodeShared(path, box, fast, tilesDir, memory, meta=None):
+    '''
+    decodeImage in a ProcessDecoder process.
+    The pixels of img (and scaled) are written to the shared memory named memory,
+    what is returned is only what is needed to read them back.
+    '''
+    timings = {}
+    decoded = decodeImage(path, box, timings, fast, TileStore(dir=tilesDir) if tilesDir else None, meta)
+    result = {
+        'animated':    decoded.animated,
+        'orientation': decoded.orientation,
+        'full':        decoded.full,
+        'fast':        decoded.fast,
+        'pyramid':     decoded.pyramid is not None,
+        'images':      [],
+        'timings':     timings,
+    }
+    if decoded.pyramid:
+        # on disk, the parent opens it
+        return result
+    from multiprocessing.shared_memory import SharedMemory
+    shm = SharedMemory(name=memory)
+    try:
+        offset = 0
+        for img in (decoded.img, decoded.scaled):
+            if img is None:
+                result['images'].append(None)
+                continue
+            if img is decoded.img and result['images']:
+                # (fast: scaled is img)
+                result['images'].append('img')
+                continue
+            data = img.tobytes()
+            shm.buf[offset:offset+len(data)] = data
+            palette = img.getpalette() if img.mode in ('P', 'PA') else None
+            result['images'].append((img.mode, img.size, offset, len(data), palette, img.info.get('transparency')))
+            offset += len(data)
+    finally:
+        shm.close()
+    return result
+
+
+class ProcessDecoder:
+    '''
+    decodeImage on a pool of processes, to decode on more cores than the GIL lets threads use.
+    Pixels come back through shared memory instead of being pickled.
+    Called like decodeImage, from any thread, each call waits for its own result.
+    '''
+    def __init__(self, processes):
+        from concurrent.futures import ProcessPoolExecutor
+        self.executor = ProcessPoolExecutor(max_workers=processes)
+
+    def __call__(self, path, box=None, timings=None, fast=False, tiles=None, meta=None):
+        clock = Stopwatch(timings)
+        if meta is not None:
+            size = (meta.width, meta.height)
+        else:
+            try:
+                with openImage(path) as img:
+                    size = img.size
+            except OSError:
+                # let the error surface as it would have
+                return decodeImage(path, box, timings, fast, tiles)
+        # room for img and scaled at up to 4 bytes a pixel
+        # (pages that are not written are not used, where the OS allows)
+        nbytes = size[0] * size[1] * 4 + (box[0] * box[1] * 4 if box else 0)
+        from multiprocessing.shared_memory import SharedMemory
+        shm = SharedMemory(create=True, size=max(nbytes, 1))
+        clock.lap('ipc')
+        try:
+            start = time.perf_counter()
+            try:
+                result = self.executor.submit(decodeShared, str(path), box, fast,
+                                              str(tiles.dir) if tiles else None, shm.name, meta).result()
+            except Exception:
+                # failed to decode, or the pool is broken or shut down: decode here
+                return decodeImage(path, box, timings, fast, tiles, meta)
+            if timings is not None:
+                timings.update(result['timings'])
+                # the rest of the wait was getting there and back
+                waited = (time.perf_counter() - start) * 1000
+                timings['ipc'] += waited - sum(result['timings'].values())
+                clock.restart()
+            if result['pyramid']:
+                return tiles.find(path, sourceStat(path)).decoded(box)
+            images = []
+            for entry in result['images']:
+                if entry is None or entry == 'img':
+                    images.append(images[0] if entry else None)
+                    continue
+                mode, imgSize, offset, length, palette, transparency = entry
+                with shm.buf[offset:offset+length] as data:
+                    img = Image.frombytes(mode, imgSize, data)
+                if palette is not None:
+                    img.putpalette(palette)
+                if transparency is not None:
+                    img.info['transparency'] = transparency
+                images.append(img)
+            clock.lap('copy')
+        finally:
+            shm.close()
+            shm.unlink()
+        img, scaled = images
+        return DecodedImage(path, img, result['animated'], result['orientation'], scaled,
+                            full=result['full'], fast=result['fast'])
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class Prefetcher:
+    '''
+    Decodes images on worker threads ahead of time.
+    Only call from the Tk thread.
+    '''
+    def __init__(self, cache, previews=None, workers=PREFETCH_WORKERS, tiles=None, decode=decodeImage, meta=None):
+        self.cache    = cache
+        self.previews = previews
+        self.tiles    = tiles
+        self.decode   = decode # decodeImage, or a ProcessDecoder
+        self.meta     = meta if meta is not None else {} # path -> ImageMeta, from the scan
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='meh-decode')
+        self.futures  = {} # (path, box) -> Future
+        self.timings  = {} # (path, box) -> stage times of the future's load
+        self.wanted   = {} # owner -> keys, see want
+
+    def load(self, path, box=None, timings=None, fast=False):
+        '''
+        Decode an image (or reuse a cached one).
+        With fast, a decode only makes a quick rendition (see decodeImage).
+        If timings (dict) is given, stage times are added to it.
+        Runs on worker threads and on the Tk thread.
+        '''
+        clock = Stopwatch(timings)
+        stat = fileStat(path)
+        mtime = stat.st_mtime_ns if stat else None
+        key = (path, mtime, box)
+        decoded = self.cache.get(key)
+        clock.lap('cache')
+        if decoded is None:
+            source = self.cache.get_source(path, mtime, box)
+            if source is not None:
+                decoded = scaleDecoded(source, box)
+                clock.lap('rescale')
+            elif self.tiles and stat:
+                pyramid = self.tiles.find(path, stat)
+                if pyramid is not None:
+                    decoded = pyramid.decoded(box)
+                clock.lap('pyramid')
+            if decoded is None and self.previews and box and stat:
+                decoded = self.load_preview(path, stat, box)
+                clock.lap('preview')
+            if decoded is None:
+                decoded = self.decode(path, box, timings, fast, self.tiles, self.meta.get(path))
+                clock.restart()
+                if decoded.fast:
+                    return decoded
+                if self.previews and box and stat and not decoded.animated and not decoded.pyramid:
+                    # saving is not on the way to the screen
+                    try:
+                        self.executor.submit(self.previews.put, path, stat, decoded.scaled)
+                    except RuntimeError:
+                        # shut down
+                        pass
+            if mtime is not None:
+                self.cache.put(key, decoded)
+                clock.lap('cache')
+        return decoded
+
+    def load_preview(self, path, stat, box):
+        img = self.previews.get(path, stat, box)
+        if img is None:
+            return None
+        scaled = img
+        fitted = fitSize(img.size, box)
+        if fitted != img.size:
+            scaled = img.resize(fitted, Image.LANCZOS)
+        # full=False: a 1:1 view decodes the original
+        return DecodedImage(path, img, False, None, scaled, full=False)
+
+    def want(self, keys, owner=None):
+        '''
+        Make the given (path, box) keys the only ones being decoded or kept for owner
+        (a pane, see SlideShow.panes: the panes share the workers).
+        Work that no owner wants any more is cancelled (or dropped when it finishes).
+        '''
+        keys = list(dict.fromkeys(keys)) # unique, in priority order
+        if keys:
+            self.wanted[owner] = keys
+        else:
+            self.wanted.pop(owner, None)
+        wanted = set().union(*self.wanted.values())
+        for key in list(self.futures):
+            if key not in wanted:
+                self.futures.pop(key).cancel()
+                self.timings.pop(key, None)
+        for key in keys:
+            if key not in self.futures:
+                # timing a load costs next to nothing next to the load
+                self.timings[key] = {}
+                self.futures[key] = self.executor.submit(self.load, *key, self.timings[key])
+
+    def get(self, path, box=None, info=None, fast=False):
+        '''
+        Get a decoded image, waiting on a prefetch if one is in flight.
+        With fast, rather than wait or decode, make a quick rendition (DecodedImage.fast),
+        an unfinished prefetch carries on.
+        If info (dict) is given, it gets how the image was got:
+        'prefetch' (done, waited, skipped or none) and the 'load' stage times.
+        '''
+        future = self.futures.get((path, box))
+        if fast and future is not None and not future.done():
+            if info is not None:
+                info['prefetch'] = 'skipped'
+                info['load'] = {}
+                return self.load(path, box, info['load'], fast=True)
+            return self.load(path, box, fast=True)
+        future = self.futures.pop((path, box), None)
+        timings = self.timings.pop((path, box), None)
+        if future is not None and not future.cancelled():
+            if info is not None:
+                info['prefetch'] = 'done' if future.done() else 'waited'
+                info['load'] = timings
+            try:
+                return future.result()
+            except Exception:
+                # decode again below so the error surfaces on this thread
+                pass
+        if info is not None:
+            info['prefetch'] = 'none'
+            info['load'] = {}
+            return self.load(path, box, info['load'], fast)
+        return self.load(path, box, fast=fast)
+
+    def done(self, path, box=None):
+        '''
+        Whether a prefetch of this image has finished.
+        '''
+        future = self.futures.get((path, box))
+        return future is not None and future.done()
+
+    def close(self):
+        for future in self.futures.values():
+            future.cancel()
+        self.futures = {}
+        self.timings = {}
+        self.wanted = {}
+        self.executor.shutdown(wait=False)
+
+
+def findRoots(pathlist):
+    '''
+    Directories to scan for the given paths, and the first file given (if any).
+    '''
+    roots = []
+    firstPath = None
+    for path in pathlist:
+        # convert to path
+        path = Path(path).resolve()
+        # an image in an archive: start with it, in the whole archive
+        member = archiveOf(path)
+        if member:
+            if firstPath is None:
+                firstPath = path
+            path = Path(member[0])
+        # if a file, get directory
+        # (users typically like to be able to scroll through the current directory)
+        # except we need to start with that file
+        elif path.is_file() and not Scanner.is_archive(path):
+            # grab first file path, use later to decide which image goes first
+            if firstPath is None:
+                firstPath = path
+            # get folder
+            path = path.parent
+        # get all files in directory (or archive)
+        if path.is_dir() or path.is_file():
+            roots.append(str(path))
+    return roots, firstPath
+
+
+def findImages(pathlist, recurse, filter):
+    '''
+    Every image in pathlist that filter (a Filter) picks, in its order.
+    '''
+    roots, firstPath = findRoots(pathlist)
+    scanner = Scanner(roots, recurse, re.compile(''))
+    paths = scanner.wait()
+    scanner.close()
+    paths.sort()
+    return list(Catalog(PathStore(paths)).view(filter))
+
+
+def warmPreviews(pathlist, recurse, filter, box, previews, workers=os.cpu_count(), decode=decodeImage):
+    '''
+    Make previews for box of every image in pathlist that filter (a Filter) picks (headless).
+    decode: decodeImage, or a ProcessDecoder (given as many workers).
+    '''
+    paths = findImages(pathlist, recurse, filter)
+
+    def warm(path):
+        stat = fileStat(path)
+        if stat is None or previews.get(path, stat, box) is not None:
+            return False
+        decoded = decode(path, box)
+        if decoded.animated:
+            return False
+        previews.put(path, stat, decoded.scaled)
+        return True
+
+    made = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='meh-warm') as executor:
+        futures = [executor.submit(warm, path) for path in paths]
+        for i, future in enumerate(futures):
+            try:
+                made += future.result()
+            except Exception as e:
+                print(f'Preview failed: "{paths[i]}": {e}')
+            if (i + 1) % 100 == 0:
+                print(f'{i+1}/{len(paths)}')
+    print(f'Made {made} previews for {len(paths)} images')
+
+
+def montage(pathlist, recurse, filter, out, thumb, columns, rows, labels=False, random=False,
+            workers=os.cpu_count(), decode=decodeImage):
+    '''
+    Contact sheets of every image in pathlist that filter (a Filter) picks, in its order
+    unless random (headless): columns x rows thumbnails
+    of up to thumb (width, height) per sheet, written to out (PNG or JPEG),
+    numbered out-001, out-002, ... if there is more than one.
+    Images are decoded ahead on workers, drafted to the thumbnail size where the codec can,
+    and only the sheet being filled is kept, so memory does not grow with the number of images.
+    decode: decodeImage, or a ProcessDecoder (given as many workers).
+    '''
+    from PIL import ImageDraw, ImageFont
+    paths = findImages(pathlist, recurse, filter)
+    if random:
+        shuffle(paths)
+    if not paths:
+        print('No images')
+        return
+
+    out = Path(out)
+    perSheet = columns * rows
+    sheets = math.ceil(len(paths) / perSheet)
+    cellWidth = thumb[0] + 2 * MONTAGE_GAP
+    cellHeight = thumb[1] + 2 * MONTAGE_GAP + (MONTAGE_LABEL if labels else 0)
+    font = ImageFont.load_default() if labels else None
+
+    def load(path):
+        try:
+            decoded = decode(path, thumb)
+        except Exception as e:
+            print(f'Thumbnail failed: "{path}": {e}')
+            return None
+        img = decoded.scaled
+        if img is None:
+            # animated, the first frame
+            img = decoded.img.resize(fitSize(decoded.img.size, thumb), Image.LANCZOS)
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'transparency' in img.info or 'A' in img.getbands() else 'RGB')
+        return img
+
+    def label(draw, name, x, y):
+        # as much of the name as fits
+        while name and draw.textlength(name, font=font) > thumb[0]:
+            name = name[:-4] + '...' if len(name) > 3 else ''
+        draw.text((x, y), name, fill=(200, 200, 200), font=font)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='meh-montage') as executor:
+        # decode a bounded number ahead, in order
+        queued = iter(paths)
+        ahead = deque(executor.submit(load, path) for path in islice(queued, 4 * workers))
+        for sheetIndex in range(sheets):
+            count = min(perSheet, len(paths) - sheetIndex * perSheet)
+            sheet = Image.new('RGB', (min(count, columns) * cellWidth, math.ceil(count / columns) * cellHeight), (0x20, 0x20, 0x20))
+            draw = ImageDraw.Draw(sheet) if labels else None
+            for i in range(count):
+                path = paths[sheetIndex * perSheet + i]
+                img = ahead.popleft().result()
+                following = next(queued, None)
+                if following is not None:
+                    ahead.append(executor.submit(load, following))
+                x = (i % columns) * cellWidth + MONTAGE_GAP
+                y = (i // columns) * cellHeight + MONTAGE_GAP
+                if img is not None:
+                    # centered in the cell
+                    position = (x + (thumb[0] - img.size[0]) // 2, y + (thumb[1] - img.size[1]) // 2)
+                    sheet.paste(img, position, img if img.mode == 'RGBA' else None)
+                if labels:
+                    label(draw, path.name, x, y + thumb[1] + 1)
+            file = out if sheets == 1 else out.with_name(f'{out.stem}-{sheetIndex+1:03}{out.suffix}')
+            if file.suffix.lower() in ('.jpg', '.jpeg'):
+                sheet.save(file, quality=90)
+            else:
+                sheet.save(file)
+            print(f'Wrote "{file}" ({sheetIndex+1}/{sheets})')
+
+
+class Resident:
+    '''
+    The listening end of --resident: later launches hand their options over a local socket
+    (see handOff) and exit, instead of starting up and scanning themselves.
+    The port, and a key that requests must carry, are in file (readable by this user only).
+    Requests are queued for the Tk thread, see SlideShow.poll_resident.
+    '''
+    def __init__(self, file=RESIDENT_FILE):
+        self.file     = Path(file)
+        self.key      = os.urandom(16).hex()
+        self.requests = queue.Queue() # options (dicts) of later launches
+        self.server   = socket.create_server(('127.0.0.1', 0))
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        # write then rename, so a launch never reads half a file
+        temp = self.file.with_name(self.file.name + '.{}.tmp'.format(os.getpid()))
+        with open(os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            json.dump({'port': self.server.getsockname()[1], 'key': self.key, 'pid': os.getpid()}, f)
+        os.replace(temp, self.file)
+        self.thread = threading.Thread(target=self.serve, name='meh-resident', daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, address = self.server.accept()
+            except OSError:
+                # closed
+                return
+            with conn:
+                try:
+                    conn.settimeout(RESIDENT_WAIT_S)
+                    data = b''
+                    while True:
+                        chunk = conn.recv(65536)
+                        if not chunk:
+                            break
+                        data += chunk
+                    request = json.loads(data)
+                    if request.get('key') != self.key:
+                        continue
+                    self.requests.put(request['args'])
+                    conn.sendall(b'ok')
+                except (OSError, ValueError, KeyError, AttributeError):
+                    pass
+
+    def poll(self):
+        '''
+        The options of the latest launch since the last call (None if none), without waiting.
+        '''
+        latest = None
+        while True:
+            try:
+                latest = self.requests.get_nowait()
+            except queue.Empty:
+                return latest
+
+    def close(self):
+        self.server.close()
+        try:
+            # unless a newer resident has taken over
+            with open(self.file) as f:
+                if json.load(f).get('key') == self.key:
+                    os.remove(self.file)
+        except (OSError, ValueError):
+            pass
+
+
+def handOff(args, file=RESIDENT_FILE):
+    '''
+    Give args (the options of this launch, a dict) to the resident instance, if there is one.
+    Returns whether it took them.
+    '''
+    try:
+        with open(file) as f:
+            resident = json.load(f)
+        with socket.create_connection(('127.0.0.1', resident['port']), timeout=RESIDENT_WAIT_S) as conn:
+            conn.sendall(json.dumps({'key': resident['key'], 'args': args}).encode('utf-8', 'surrogateescape'))
+            conn.shutdown(socket.SHUT_WR)
+            return conn.recv(2) == b'ok'
+    except (OSError, ValueError, KeyError, TypeError):
+        # none, or gone without removing its file
+        return False
+
+
 class SlideShow:
     FILE_TYPES_LC = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
 
-    def __init__(self, pathlist, recurse, regex, fullscreen, paused, delay, zoomed, width, height, x, y, shuffle):
+    def __init__(self, pathlist, recurse, regex, fullscreen, paused, delay, zoomed, width, height, x, y, shuffle, cache_mb=CACHE_MB, index=None, watch=False, preview_mb=None, window=True, trace=None, progressive=False, decode_processes=0, read_meta=False, resident=None, filter='', panes=(), lead=None):
         # window
+        self.root        = None
         self.title       = 'meh.py'
         self.fullscreen  = fullscreen
         self.width       = width
@@ -85,33 +2920,115 @@ class SlideShow:
         self.zoomedSize  = None
         self.paused      = paused
         self.delayms     = int(delay*1000)
-        self.slide       = None
+        self.slide       = None # canvas item, kept and given each new photo
+        self.shownPhoto  = None # photo of the slide on screen (self.photo may be the next, being prepared)
+        self.pending     = None # the next slide, prepared ahead of its deadline (see prepare)
+        self.preparing   = False
+        self.buffers     = PhotoBuffers()
+        self.looperid    = None
+        self.deadlines   = Deadlines() # autoplay timing
         self.shuffle     = shuffle
         self.reloadId    = None
+        self.progressive = progressive # quick rendition first, see refine
+        self.refineId    = None
         # image selection
         self.recurse     = recurse
-        self.pattern     = re.compile(regex, re.IGNORECASE) # filter files
+        self.pattern     = re.compile('') # the scan finds every image, the filter picks from the catalog
+        self.filter      = Filter(filter, regex)
+        self.filterEntry = None
         self.pathlist    = pathlist # list of images or directories to search
-        self.imagepaths  = []
-        self.length      = 0
+        self.catalog     = Catalog()
+        self.imagepaths  = PathStore() # what the filter shows of the catalog (see Catalog.view)
+        self.scanner     = None
+        self.roots       = []
+        self.watcher     = None
+        self.length      = 0  # entries in imagepaths, including deleted ones
+        self.runStarts   = None # folder runs, see PathStore.runs (made when first needed, see folder_runs)
+        self.runDirs     = None
+        self.runAlive    = None
         self.index       = 0
         self.previous    = 0
         self.img         = None
+        self.scaled      = None
         self.photo       = None
+        self.quick       = False # a quick rendition is up, see refine
+        self.randQueue   = deque() # upcoming random indices, drawn early for prefetch
+        self.shuffler    = Shuffle(0)
+        self.history     = deque(maxlen=SHUFFLE_HISTORY) # paths shown in shuffle order
+        self.historyBack = 0 # steps back from the end of history
+        # more windows (panes) in this process, see panes
+        self.lead        = lead or self # the pane that scans, watches and runs the workers
+        self.panes       = [self] # in the lead, every open pane (itself first)
+        self.shared      = bool(panes) or lead is not None # whether the catalog is shared
+        if lead is None:
+            self.library    = LibraryIndex(index) if index else None
+            self.cache      = ImageCache(int(cache_mb*1024*1024))
+            self.previews   = PreviewCache(int(preview_mb*1024*1024)) if preview_mb else None
+            self.readMeta   = read_meta
+            self.meta       = {} # path -> ImageMeta, if read_meta
+            self.tiles      = TileStore()
+            self.decoder    = ProcessDecoder(decode_processes) if decode_processes else None
+            self.prefetcher = Prefetcher(self.cache, self.previews,
+                                         workers=max(PREFETCH_WORKERS * (1 + len(panes)), decode_processes),
+                                         tiles=self.tiles,
+                                         decode=self.decoder or decodeImage,
+                                         meta=self.meta)
+        else:
+            # one catalog, cache and pool of decode workers for all the panes
+            self.library    = lead.library
+            self.cache      = lead.cache
+            self.previews   = lead.previews
+            self.readMeta   = lead.readMeta
+            self.meta       = lead.meta
+            self.tiles      = lead.tiles
+            self.decoder    = lead.decoder
+            self.prefetcher = lead.prefetcher
+        # very large images, see TileStore
+        self.pyramid     = None
+        self.viewScale   = None # screen pixels per image pixel, None to fit (or 1:1 if not zoomed)
+        self.viewCenter  = None # image pixel in the middle of the window, None for the middle of the image
+        self.dragFrom    = None
+        self.renderId    = None
         # animation
-        self.gifDelay = 0
-        self.gifIndex = 0
-        self.gifFrames = []
-        self.gifPhotos = []
+        self.animation = None
+        self.gifId = None
+        # timing (-v), None when off
+        self.trace     = lead.trace if lead else Trace(trace) if trace else None
+        self.timings   = None # stage times of the slide (or frame) being shown
+        self.traceInfo = None
+        # later launches handed over (--resident), None when off
+        self.resident  = resident
+        self.idleId    = None
+        self.scanId    = None
 
-        self.update_imagepaths()
-
-        # if no images, close
-        if not self.imagepaths:
+        # headless: no window, the caller drives (see benchmarks)
+        if not window:
+            self.update_imagepaths()
             return
 
+        if lead:
+            # a pane: what its filter picks from the lead's catalog
+            self.use_catalog(lead.catalog)
+            if not self.imagepaths:
+                print(f'No images for the pane at {width}x{height}+{x}+{y}')
+                return
+            if self.shuffle:
+                # (not the lead's first image)
+                self.index = self.previous = self.imagepaths.next_alive(self.shuffler.next())
+        else:
+            # show the first image(s) while the rest of the scan continues
+            self.update_imagepaths(stream=True)
+            if watch:
+                self.watcher = Watcher(self.roots, self.recurse, self.pattern, self.library)
+            self.merge_first(panes)
+
+            # if no images, close
+            if not self.imagepaths:
+                self.stop_workers()
+                return
+
         # init Tkinter window
-        self.root = tk.Tk()
+        self.root = tk.Toplevel(lead.root) if lead else tk.Tk()
         if self.fullscreen:
             self.width      = self.root.winfo_screenwidth()
             self.height     = self.root.winfo_screenheight()
@@ -142,6 +3059,8 @@ class SlideShow:
         self.root.bind("<,>",                    self.slow_down)
         self.root.bind("<.>",                    self.speed_up)
         self.root.bind("<y>",                    self.reload_imagepaths)
+        self.root.bind("</>",                    self.edit_filter)
+        self.root.bind("<o>",                    self.cycle_sort)
         self.root.bind("<Left>",                 self.prev_index)
         self.root.bind("<a>",                    self.prev_index)
         self.root.bind("<Right>",                self.next_index)
@@ -159,216 +3078,838 @@ class SlideShow:
         self.root.bind("<Control-Shift-Delete>", self.delete_folder)
         self.root.bind("<Delete>",               self.delete_file)
         self.root.bind("<Configure>",            self.on_resize) # not working
+        self.root.bind("<Key-1>",                self.actual_size)
+        self.root.bind("<Key-0>",                self.fit_size)
+        self.root.bind("<MouseWheel>",           self.wheel_zoom)
+        self.root.bind("<Button-4>",             self.wheel_zoom) # X11 wheel
+        self.root.bind("<Button-5>",             self.wheel_zoom)
+        self.root.bind("<ButtonPress-1>",        self.drag_start)
+        self.root.bind("<B1-Motion>",            self.drag)
+        self.root.protocol("WM_DELETE_WINDOW",   self.close_out)
 
         # show
         self.show() # in case paused
-        self.showloop()
+        self.schedule()
+        if lead:
+            # the lead's event loop runs the pane
+            return
+        self.open_panes(panes)
+        # merge what the scan has found (or will find)
+        self.scanId = self.root.after(SCAN_POLL_MS, self.poll_scan)
+        if self.watcher:
+            self.root.after(WATCH_POLL_MS, self.poll_watch)
+        if self.resident:
+            self.root.after(RESIDENT_POLL_MS, self.poll_resident)
         self.root.mainloop()
 
         # quit
+        self.stop_workers()
         try:
             self.root.destroy()
         except:
             pass
 
-    def update_imagepaths(self):
+    def update_imagepaths(self, stream=False):
         '''
         From given paths, get all files in the current directory.
         Recurse if requested.
         Can be called again to update.
+        With stream, return right away with only the file that was asked for (if any),
+        the rest is merged in by poll_scan as the scan finds it.
         '''
 
-        # setup glob string
-        globStr = '*.*'
-        if self.recurse:
-            globStr = '**/' + globStr
+        timings = {} if self.trace else None
+        clock = Stopwatch(timings)
+
+        # find directories to scan
+        roots, firstPath = findRoots(self.pathlist)
+        clock.lap('roots')
 
         # generate list of all paths
-        self.imagepaths = []
-        firstPath = None
-        for path in self.pathlist:
-            # convert to path
-            path = Path(path).resolve()
-            # if a file, get directory
-            # (users typically like to be able to scroll through the current directory)
-            # except we need to start with that file
-            if path.is_file():
-                # grab first file path, use later to decide which image goes first
-                if firstPath is None:
-                    firstPath = path
-                # get folder
-                path = path.parent
-            # get all files in directory
-            if path.is_dir():
-                for f in path.glob(globStr):
-                    if f.is_file() and \
-                       (f.suffix.lower() in SlideShow.FILE_TYPES_LC) and \
-                       (self.pattern.search(str(f)) is not None):
-                        self.imagepaths.append(f.resolve())
+        self.roots = roots
+        if self.scanner:
+            self.scanner.close()
+        if self.readMeta:
+            self.meta.clear()
+        self.scanner = Scanner(roots, self.recurse, self.pattern, self.library,
+                               meta=self.meta if self.readMeta else None)
+        if stream:
+            paths = []
+            if firstPath is not None and self.scanner.matches(str(firstPath)):
+                paths.append(firstPath)
+        else:
+            paths = self.scanner.wait()
+        clock.lap('scan')
 
         # sort list
-        self.imagepaths.sort()
+        paths.sort()
+        clock.lap('sort')
+        self.catalog = Catalog(PathStore(paths), self.library, self.meta)
+        self.imagepaths = self.catalog.view(self.filter, self.shared)
+        for pane in self.panes[1:]:
+            pane.use_catalog(self.catalog)
+        clock.lap('store')
 
-        # get length
-        self.length = len(self.imagepaths)
+        # get length and folders
+        self.update_runs()
+        clock.lap('runs')
+        if timings is not None:
+            self.trace.write('scan', timings, images=len(self.imagepaths), stream=stream)
 
         # choose a starting index
         self.index = 0
         if firstPath is not None:
-            for i,f in enumerate(self.imagepaths):
-                if f.samefile(firstPath):
-                    self.index = i
-                    break
+            self.index = self.imagepaths.index_of(firstPath) or 0
         # set previous
         self.previous = self.index
 
         return self.imagepaths
 
+    def update_runs(self):
+        '''
+        Call after changing imagepaths.
+        '''
+        self.length = self.imagepaths.slots
+        self.randQueue.clear()
+        self.drop_pending()
+        if self.shuffler.n != self.length:
+            # indices have moved, start a new round
+            self.shuffler.reset(self.length)
+        self.runStarts = self.runDirs = self.runAlive = None
+
+    def folder_runs(self):
+        '''
+        Folder runs of imagepaths (see PathStore.runs), made when first needed:
+        only moving by folder and the window title in path order use them.
+        '''
+        if self.runStarts is None:
+            self.runStarts, self.runDirs, self.runAlive = self.imagepaths.runs()
+        return self.runStarts, self.runDirs, self.runAlive
+
+    def run_of(self, index):
+        return bisect_right(self.folder_runs()[0], index) - 1
+
+    def remove_from_runs(self, index):
+        '''
+        Keep the folder runs in step with deleting one entry, without a rebuild.
+        Call before deleting it.
+        '''
+        if self.runStarts is None:
+            # not made yet
+            return
+        starts, dirs, alive = self.runStarts, self.runDirs, self.runAlive
+        run = self.run_of(index)
+        alive[run] -= 1
+        if alive[run] == 0 and len(starts) > 1:
+            # run is gone (its tombstones join the run before),
+            # the runs either side of it may now be one
+            del starts[run], dirs[run], alive[run]
+            if 0 < run < len(starts) and dirs[run-1] == dirs[run]:
+                alive[run-1] += alive[run]
+                del starts[run], dirs[run], alive[run]
+
+    def compact(self):
+        '''
+        Squeeze out deleted entries, once there are enough of them.
+        '''
+        store = self.imagepaths
+        if store.slots - store.count < max(COMPACT_MIN, store.slots // 4):
+            return
+        self.index = store.rank(self.index) % max(store.count, 1)
+        self.previous = store.rank(self.previous) % max(store.count, 1)
+        self.imagepaths = store.compacted()
+        if store is self.catalog.paths:
+            self.catalog = Catalog(self.imagepaths, self.library, self.meta)
+        self.update_runs()
+
+    def window_title(self):
+        title = str(self.title)
+        if self.filter.sort == 'path' and len(self.folder_runs()[0]) > 1:
+            # (other orders mix the folders up)
+            title = '{}  (folder {} of {})'.format(title, self.run_of(self.index)+1, len(self.runStarts))
+        if self.filter:
+            title = '{}  [{}: {} of {}]'.format(title, self.filter, len(self.imagepaths), len(self.catalog.paths))
+        return title
+
+    def merge_scan(self, found):
+        '''
+        Insert newly found paths into the catalog, in place (see Catalog.insert),
+        staying on the current (and previous) image of every pane.
+        '''
+        if not found:
+            return
+        timings = {} if self.trace else None
+        clock = Stopwatch(timings)
+        paths = self.catalog.paths
+        # the file asked for is found again by the scan
+        found = [path for path in sorted(set(found)) if paths.index_of(path) is None]
+        if not found:
+            return
+        spots = [pane.spot() for pane in self.panes]
+        self.catalog.insert(found)
+        clock.lap('insert')
+        for pane, spot in zip(self.panes, spots):
+            pane.use_catalog(self.catalog, spot)
+        clock.lap('merge')
+        if timings is not None:
+            self.trace.write('merge', timings, found=len(found), images=len(self.imagepaths))
+
+    def remove_paths(self, paths=(), dirs=()):
+        '''
+        Remove paths, and everything under dirs, from the list (of every pane),
+        leaving tombstones (see drop_indices).
+        Returns the panes whose current image was removed.
+        '''
+        store = self.catalog.paths
+        entries = set()
+        for path in paths:
+            entry = store.index_of(path)
+            if entry is not None:
+                entries.add(entry)
+        for dir in dirs:
+            entries.update(store.under(dir))
+        if not entries:
+            return []
+        for entry in entries:
+            self.meta.pop(store[entry], None)
+        for path in list(paths) + list(dirs):
+            self.cache.invalidate(path)
+        # where each pane has them, before the first delete takes them out of the catalog
+        panes = list(self.lead.panes)
+        indices = [[index for index in map(pane.imagepaths.locate, entries) if index is not None] for pane in panes]
+        return [pane for pane, found in zip(panes, indices) if pane.drop_indices(found)]
+
+    def spot(self):
+        # the current and previous image, to stay on when imagepaths changes
+        if not self.imagepaths:
+            return None, None
+        return self.imagepaths[self.index], self.imagepaths[self.previous]
+
+    def use_catalog(self, catalog, spot=None):
+        '''
+        Show what the filter picks from catalog (the scan, with files found or gone since),
+        staying on the current (and previous) image (or spot, taken before catalog changed in place),
+        or the one after it if gone.
+        '''
+        current, previous = spot or self.spot()
+        self.catalog = catalog
+        self.imagepaths = catalog.view(self.filter, self.shared)
+        self.update_runs()
+        if current is None or self.length == 0:
+            return
+        self.index = self.imagepaths.bisect(current) % self.length
+        self.previous = self.imagepaths.bisect(previous) % self.length
+
+    def poll_watch(self):
+        added, removed, removedDirs = self.watcher.poll()
+        self.merge_scan(added)
+        if removed or removedDirs:
+            for pane in self.remove_paths(removed, removedDirs):
+                if pane not in self.panes:
+                    # closed with the lead (--resident)
+                    continue
+                # the image on screen is gone
+                if pane.imagepaths:
+                    pane.show()
+                else:
+                    pane.close_out()
+                    if pane is self and not self.resident:
+                        return
+        self.root.after(WATCH_POLL_MS, self.poll_watch)
+
+    def poll_scan(self):
+        done = self.scanner.done()
+        self.scanId = None
+        if self.waits_for_scan() and not done:
+            # sorting and filtering by file columns go over the whole catalog: merged once the scan is done
+            self.scanId = self.root.after(SCAN_POLL_MS, self.poll_scan)
+            return
+        self.merge_scan(self.scanner.poll())
+        if not done:
+            self.scanId = self.root.after(SCAN_POLL_MS, self.poll_scan)
+        elif self.trace:
+            self.trace.write('scan_done', {'scan': self.scanner.elapsed * 1000}, images=len(self.imagepaths))
+
+    def waits_for_scan(self):
+        '''
+        Whether any pane has a filter that needs the whole catalog (see Filter.streams).
+        '''
+        return not all(pane.filter.streams() for pane in self.panes)
+
+    def merge_first(self, panes=()):
+        '''
+        Before the window opens: merge what the scan finds until there is an image to show,
+        here and in each of the panes to be opened (their options, see open_panes),
+        or the scan is done. A filter that needs the whole catalog waits for all of it.
+        '''
+        filters = [Filter(options['filter'], options['regex']) for options in panes]
+        if not all(filter.streams() for filter in [self.filter] + filters):
+            if not self.imagepaths:
+                self.merge_scan(self.scanner.wait())
+            return
+        while not self.scanner.done() and not (self.imagepaths and all(self.catalog.view(filter) for filter in filters)):
+            self.merge_scan(self.scanner.wait_any())
+        self.merge_scan(self.scanner.poll())
+
+    def open_panes(self, panes):
+        '''
+        Open more windows on the lead's catalog, each with its own options (a dict of
+        SlideShow's: geometry, order, filter, shuffle, delay...), see --pane.
+        '''
+        for options in panes:
+            pane = SlideShow(self.pathlist, self.recurse, lead=self, **options)
+            if pane.root:
+                self.panes.append(pane)
+
+    def poll_resident(self):
+        args = self.resident.poll()
+        if args is not None:
+            self.retarget(args)
+        self.root.after(RESIDENT_POLL_MS, self.poll_resident)
+
+    def retarget(self, args):
+        '''
+        Show what a later launch handed over (see Resident) in this window, with the caches warm.
+        args are its options (the parsed command line, as a dict): paths and slide show options
+        are taken from it, while the window size, caches, index and decode processes stay as they are.
+        '''
+        try:
+            filter = Filter(args['filter'], args['regex'])
+        except ValueError as e:
+            print(f'Bad filter: {e}')
+            return
+        if self.idleId:
+            self.root.after_cancel(self.idleId)
+            self.idleId = None
+        self.stop_animation()
+        self.stop_refine()
+        self.close_panes()
+        self.shared      = bool(args['panes'])
+        self.pathlist    = args['paths']
+        self.recurse     = args['recurse']
+        self.filter      = filter
+        self.shuffle     = args['random']
+        self.zoomed      = args['zoomed']
+        self.paused      = not args['auto']
+        self.delayms     = int(args['delay']*1000)
+        self.progressive = args['progressive']
+        self.history.clear()
+        self.historyBack = 0
+        self.update_imagepaths(stream=True)
+        if self.watcher:
+            self.watcher.close()
+            self.watcher = Watcher(self.roots, self.recurse, self.pattern, self.library)
+        self.merge_first(args['panes'])
+        if not self.imagepaths:
+            print('No images')
+            self.hide()
+            return
+        if self.scanId is None:
+            self.scanId = self.root.after(SCAN_POLL_MS, self.poll_scan)
+        self.root.deiconify()
+        if args['fullscreen'] and not self.fullscreen:
+            self.toggle_fullscreen()
+        self.root.lift()
+        self.root.focus_force()
+        self.show_and_reset_timer()
+        self.open_panes(args['panes'])
+
+    def hide(self):
+        '''
+        Close the window but keep running (--resident), until a launch hands over
+        or RESIDENT_IDLE_S pass.
+        '''
+        self.paused = True
+        self.stop_animation()
+        self.stop_refine()
+        self.close_panes()
+        self.root.withdraw()
+        if self.idleId:
+            self.root.after_cancel(self.idleId)
+        self.idleId = self.root.after(RESIDENT_IDLE_S * 1000, self.quit)
+
     def selectImage(self, force=False):
         # get image
         #print('{:{w:}}/{:{w:}}  rand:{:<5}  "{}"'.format(self.index, self.length, str(self.shuffle), self.imagepaths[self.index], w=len(str(self.length))))
         if self.title != self.imagepaths[self.index] or force:
+            clock = Stopwatch(self.timings)
+            if not self.preparing:
+                self.stop_refine()
+            if self.title != self.imagepaths[self.index]:
+                # new image, new view
+                self.viewScale = self.viewCenter = None
             self.title = self.imagepaths[self.index]
-            self.root.wm_title(self.title)
-            self.img = Image.open(self.title)
-
-            # deal with roation
-            # https://stackoverflow.com/questions/13872331/rotating-an-image-with-orientation-specified-in-exif-using-python-without-pil-in
-            exif = self.img.getexif()
-            if exif is not None:
-                try:
-                    if exif[EXIF_ORIENTATION_TAG] == 3:
-                        self.img = self.img.rotate(180, expand=True)
-                    elif exif[EXIF_ORIENTATION_TAG] == 6:
-                        self.img = self.img.rotate(270, expand=True)
-                    elif exif[EXIF_ORIENTATION_TAG] == 8:
-                        self.img = self.img.rotate(90, expand=True)
-                except (AttributeError, KeyError, IndexError):
-                    # cases: image don't have getexif
-                    pass
+            decoded = self.prefetcher.get(self.title, self.box(), self.traceInfo, self.progressive)
+            clock.lap('get')
+            self.img = decoded.img
+            self.scaled = decoded.scaled
+            self.pyramid = decoded.pyramid
+            self.quick = decoded.fast
 
             # deal with animation
-            if self.title.suffix.lower() == '.gif':
-                # get delay
-                if 'duration' in self.img.info:
-                    self.gifDelay = self.img.info['duration']
-                else:
-                    self.gifDelay = 100
-                # get frames
-                self.gifFrames = []
-                for frame in ImageSequence.Iterator(self.img):
-                    self.gifFrames.append(frame.copy())
-                # initialize
-                self.gifIndex = 0
-                self.img = self.gifFrames[self.gifIndex]
-                if len(self.gifFrames) > 1:
-                    self.gifId = self.root.after(self.gifDelay, self.gifLoop)
+            if decoded.animated and self.animation and self.animation.path == self.title:
+                # same animation (window resized), keep playing
+                pass
             else:
-                # not a gif, clear all gif info
-                self.gifDelay = 0
-                self.gifIndex = 0
-                self.gifFrames = []
-                self.gifPhotos = []
+                if self.preparing:
+                    # the one on screen plays on until this goes up
+                    self.animation = None
+                else:
+                    self.stop_animation()
+                if decoded.animated:
+                    self.animation = Animation(decoded, self.makePhoto)
+            clock.lap('animation')
+            if not self.preparing:
+                self.start_slide()
+
+    def start_slide(self):
+        # what goes with a new slide: its window title, and the timers that refine or animate it
+        if self.root is None:
+            return
+        self.root.wm_title(self.window_title())
+        if self.quick and not self.refineId:
+            self.refineId = self.root.after(REFINE_IDLE_MS, self.refine)
+        if self.animation and not self.gifId:
+            self.gifId = self.root.after(self.animation.delay(), self.gifLoop)
+
+    def makePhoto(self, img):
+        # headless, keep the PIL image
+        if self.root is None:
+            return img
+        return ImageTk.PhotoImage(img)
+
+    def stillPhoto(self, img):
+        # drawn into a photo kept for reuse (see PhotoBuffers)
+        if self.root is None:
+            return img
+        return self.buffers.photo(img, (self.shownPhoto, self.pending and self.pending['photo']))
+
+    def refine(self):
+        '''
+        Replace the quick rendition on screen with the full-quality one,
+        once the slide has stayed up for a moment.
+        '''
+        box = self.box()
+        if self.prefetcher.done(self.title, box):
+            self.refineId = None
+            self.reload()
+            return
+        # only this one, the prefetch picks up again after the reload
+        self.prefetcher.want([(self.title, box)], owner=self)
+        self.refineId = self.root.after(REFINE_POLL_MS, self.refine)
+
+    def stop_refine(self):
+        if self.refineId:
+            self.root.after_cancel(self.refineId)
+            self.refineId = None
+
+    def stop_animation(self):
+        if self.gifId:
+            self.root.after_cancel(self.gifId)
+            self.gifId = None
+        if self.animation:
+            self.animation.close()
+            self.animation = None
+
+    def box(self):
+        '''
+        Size images are scaled to fit, None if not zoomed.
+        '''
+        if self.zoomed:
+            return (int(self.width), int(self.height))
+        return None
+
+    def upcoming_indices(self):
+        '''
+        Indices the user is likely to go to next, most likely first.
+        Follows the navigation keys: next (or random), previous, back, folder jumps.
+        '''
+        indices = []
+        if self.shuffle:
+            # forward through history, then the random picks,
+            # drawn now so the prefetch matches them
+            for i in range(1, min(self.historyBack, PREFETCH_AHEAD) + 1):
+                indices.append(self.history_index(self.historyBack - i))
+            last = self.randQueue[-1] if self.randQueue else self.index
+            while len(self.randQueue) < PREFETCH_AHEAD and len(self.imagepaths) > 1:
+                last = self.draw_rand(last)
+                self.randQueue.append(last)
+            indices += list(self.randQueue)[:PREFETCH_AHEAD]
+            # and back through history
+            for i in range(1, PREFETCH_AHEAD + 1):
+                if self.historyBack + i < len(self.history):
+                    indices.append(self.history_index(self.historyBack + i))
+        else:
+            temp = self.index
+            for i in range(PREFETCH_AHEAD):
+                temp = self.step(temp, 1)
+                indices.append(temp)
+        temp = self.index
+        for i in range(PREFETCH_AHEAD):
+            temp = self.step(temp, -1)
+            indices.append(temp)
+        indices.append(self.previous)
+        indices += [self.first_of_next_dir(), self.last_of_prev_dir()]
+        return [i for i in indices if i is not None and i != self.index and i < self.length and self.imagepaths.is_alive(i)]
+
+    def prefetch(self):
+        clock = Stopwatch(self.timings)
+        box = self.box()
+        keys = [(self.imagepaths[i], box) for i in self.upcoming_indices()]
+        if self.refineId:
+            # a quick rendition is on screen, its full-quality decode carries on (see refine)
+            keys.insert(0, (self.title, box))
+        self.prefetcher.want(keys, owner=self)
+        clock.lap('prefetch')
 
     def gifLoop(self, event=None):
-        if self.gifFrames:
-            # increment index
-            self.gifIndex += 1
-            self.gifIndex %= len(self.gifFrames)
-            # get photo
-            self.photo = self.getGifPhoto(
-                self.gifFrames, 
-                self.gifIndex, 
-                self.zoomedSize
-            )
+        if self.animation:
+            self.start_timing()
+            clock = Stopwatch(self.timings)
+            # next frame
+            self.animation.advance()
+            clock.lap('advance')
+            self.photo = self.animation.photo(self.zoomedSize)
+            clock.lap('photo')
             # draw frame
             self.showSlide()
             if self.gifId:
                 self.root.after_cancel(self.gifId)
-            self.gifId = self.root.after(self.gifDelay, self.gifLoop)
-
-    @staticmethod
-    def getGifPhoto(frames, index, size=None):
-        frame = frames[index]
-        if size:
-            frame = frame.resize(size, Image.ANTIALIAS)
-        return ImageTk.PhotoImage(frame)
+            self.gifId = self.root.after(self.animation.delay(), self.gifLoop)
+            self.end_timing('frame', frame=self.animation.index)
 
     def resizeImage(self):
-        if self.zoomed:
-            # zoomed, resize
-            widthratio = float(self.width)/self.img.size[0]
-            heightratio = float(self.height)/self.img.size[1]
-            # get new size
-            if widthratio < heightratio:
-                self.zoomedSize = (int(self.width), int(self.img.size[1]*widthratio))
-            else:
-                self.zoomedSize = (int(self.img.size[0]*heightratio), int(self.height))
+        clock = Stopwatch(self.timings)
+        if self.pyramid:
+            # only what is in the window
+            self.zoomedSize = None
+            view = self.pyramid.render(self.view_center(), self.view_scale(), (int(self.width), int(self.height)))
+            clock.lap('render')
+            self.photo = self.stillPhoto(view)
+        elif self.zoomed:
+            # zoomed, resize (to the size the header gives, if read,
+            # so quick, drafted and full renditions all come out the same)
+            meta = self.meta.get(self.title)
+            if meta is None or not meta.fits(self.img.size):
+                meta = None
+            self.zoomedSize = fitSize(meta.size if meta else self.img.size, self.box())
             # resize image
-            if self.gifFrames:
-                self.photo = self.getGifPhoto(
-                    self.gifFrames, 
-                    self.gifIndex, 
-                    self.zoomedSize
-                )
+            if self.animation:
+                self.photo = self.animation.photo(self.zoomedSize)
+            elif self.scaled is not None and self.scaled.size == self.zoomedSize:
+                # already scaled by the decoder
+                self.photo = self.stillPhoto(self.scaled)
             else:
-                self.photo = ImageTk.PhotoImage(self.img.resize(self.zoomedSize, Image.ANTIALIAS))
+                resized = self.img.resize(self.zoomedSize, Image.LANCZOS)
+                clock.lap('resize')
+                self.photo = self.stillPhoto(resized)
         else:
             self.zoomedSize = None
             # keep size
-            if self.gifFrames:
-                self.gifPhotos = [ImageTk.PhotoImage(f) for f in self.gifFrames]
-                self.photo = self.gifPhotos[self.gifIndex]
+            if self.animation:
+                self.photo = self.animation.photo()
             else:
-                self.photo = ImageTk.PhotoImage(self.img)
+                self.photo = self.stillPhoto(self.img)
+        clock.lap('photo')
 
     def reload(self, event=None):
-        self.selectImage(force=True)
+        self.start_timing()
+        if not self.pyramid:
+            # (a pyramid can draw any size as it is)
+            self.selectImage(force=True)
         self.resizeImage()
         self.showSlide()
+        self.prefetch()
+        self.end_timing('slide', path=self.title)
 
     def show(self):
+        self.start_timing()
         self.selectImage()
         self.resizeImage()
         self.showSlide()
+        self.prefetch()
+        self.end_timing('slide', path=self.title)
+
+    def view_scale(self):
+        if self.viewScale:
+            return self.viewScale
+        return self.pyramid.fitScale((self.width, self.height)) if self.zoomed else 1.0
+
+    def view_center(self):
+        if self.viewCenter:
+            return self.viewCenter
+        return (self.pyramid.size[0] / 2, self.pyramid.size[1] / 2)
+
+    def set_view(self, scale, center):
+        '''
+        Pan and zoom a pyramid, keeping some of the image in the window.
+        '''
+        self.viewScale = scale
+        self.viewCenter = (min(max(center[0], 0), self.pyramid.size[0]),
+                           min(max(center[1], 0), self.pyramid.size[1]))
+        self.request_view()
+
+    def request_view(self):
+        # draw once the events so far are handled
+        if not self.renderId:
+            self.renderId = self.root.after_idle(self.render_view)
+
+    def render_view(self):
+        self.renderId = None
+        if self.pyramid:
+            self.start_timing()
+            self.resizeImage()
+            self.showSlide()
+            self.end_timing('view', path=self.title, scale=round(self.view_scale(), 4))
+
+    def wheel_zoom(self, event):
+        '''
+        Zoom in or out of a pyramid around the mouse.
+        '''
+        if not self.pyramid:
+            return
+        up = event.num == 4 or event.delta > 0
+        old = self.view_scale()
+        fit = min(self.pyramid.fitScale((self.width, self.height)), 1.0)
+        scale = min(max(old * (ZOOM_STEP if up else 1 / ZOOM_STEP), fit), ZOOM_MAX)
+        # keep the image pixel under the mouse there
+        center = self.view_center()
+        dx, dy = event.x - self.width / 2, event.y - self.height / 2
+        x, y = center[0] + dx / old, center[1] + dy / old
+        self.set_view(scale, (x - dx / scale, y - dy / scale))
+        return "break"
+
+    def drag_start(self, event):
+        self.dragFrom = (event.x, event.y)
+
+    def drag(self, event):
+        if not self.pyramid or not self.dragFrom:
+            return
+        scale = self.view_scale()
+        center = self.view_center()
+        dx, dy = event.x - self.dragFrom[0], event.y - self.dragFrom[1]
+        self.dragFrom = (event.x, event.y)
+        self.set_view(scale, (center[0] - dx / scale, center[1] - dy / scale))
+
+    def actual_size(self, event=None):
+        '''
+        1:1, for a pyramid just its view, otherwise switch zoom off.
+        '''
+        if self.pyramid:
+            self.set_view(1.0, self.view_center())
+        elif self.zoomed:
+            self.zoomed = False
+            self.reload()
+        return "break"
+
+    def fit_size(self, event=None):
+        if self.pyramid:
+            self.viewScale = self.viewCenter = None
+            self.request_view()
+        elif not self.zoomed:
+            self.zoomed = True
+            self.reload()
+        return "break"
+
+    def start_timing(self):
+        if self.trace:
+            self.timings = {}
+            self.traceInfo = {}
+
+    def end_timing(self, event, **info):
+        if self.timings is not None:
+            info.update(self.traceInfo)
+            if self in self.lead.panes[1:]:
+                info['pane'] = self.lead.panes.index(self)
+            self.trace.write(event, self.timings, **info)
+            self.timings = self.traceInfo = None
 
     def showSlide(self):
-        # switch slides
-        if self.slide:
-            self.canvas.delete(self.slide)
-        self.slide = self.canvas.create_image(self.width/2, self.height/2, image=self.photo)
+        if self.root is None:
+            return
+        clock = Stopwatch(self.timings)
+        # switch slides (the same canvas item, given the new photo)
+        if self.slide is None:
+            self.slide = self.canvas.create_image(self.width/2, self.height/2, image=self.photo)
+        else:
+            self.canvas.itemconfigure(self.slide, image=self.photo)
+            self.canvas.coords(self.slide, self.width/2, self.height/2)
+        self.shownPhoto = self.photo
+        clock.lap('canvas')
+        if self.timings is not None:
+            # draw now, so the time is counted here rather than lost in the event loop
+            self.root.update_idletasks()
+            clock.lap('draw')
         
+    def schedule(self):
+        '''
+        Autoplay the next slide delay from now.
+        '''
+        if self.looperid:
+            self.root.after_cancel(self.looperid)
+        self.drop_pending()
+        self.deadlines.restart(self.delayms / 1000)
+        self.looperid = self.root.after(self.deadlines.wait_ms(self.deadlines.lead()), self.showloop)
+
     def showloop(self):
-        # increment index
-        if not self.paused:
-            if self.shuffle:
-                # random
-                self.get_rand()
+        if self.paused:
+            # check again after a delay
+            self.schedule()
+            return
+        # prepare the next slide ahead of its deadline (see Deadlines),
+        # the one on screen stays up until then
+        started = time.perf_counter()
+        self.start_timing()
+        self.prepare()
+        self.deadlines.prepared(time.perf_counter() - started)
+        self.looperid = self.root.after(self.deadlines.wait_ms(), self.present)
+
+    # what preparing the next slide changes, set aside until it goes up (see prepare)
+    SLIDE_STATE = ('index', 'previous', 'history', 'historyBack', 'randQueue', 'title', 'viewScale', 'viewCenter',
+                   'img', 'scaled', 'pyramid', 'animation', 'quick', 'zoomedSize', 'photo')
+
+    def prepare(self):
+        '''
+        Decode and scale the next slide into self.pending, for present to put up.
+        Until then everything (keys, deletes, the window title) stays on the slide on screen.
+        '''
+        shown = {name: getattr(self, name) for name in SlideShow.SLIDE_STATE}
+        self.history = self.history.copy()
+        self.randQueue = self.randQueue.copy()
+        self.preparing = True
+        try:
+            self.get_forward()
+            self.selectImage()
+            self.resizeImage()
+            self.pending = {name: getattr(self, name) for name in SlideShow.SLIDE_STATE}
+            self.pending['box'] = self.box()
+        finally:
+            self.preparing = False
+            for name, value in shown.items():
+                setattr(self, name, value)
+
+    def drop_pending(self):
+        # the prepared slide will not go up (the slide show moved on, or the list changed)
+        if self.pending is None:
+            return
+        if self.pending['animation'] and self.pending['animation'] is not self.animation:
+            self.pending['animation'].close()
+        self.pending = None
+
+    def present(self):
+        # put the prepared slide up, on its deadline (prepared again if the window or list changed since)
+        if self.paused:
+            self.schedule()
+            return
+        if self.pending is None or self.pending['box'] != self.box():
+            self.drop_pending()
+            self.prepare()
+        pending, self.pending = self.pending, None
+        self.stop_refine()
+        if self.animation is not pending['animation']:
+            self.stop_animation()
+        for name in SlideShow.SLIDE_STATE:
+            setattr(self, name, pending[name])
+        self.start_slide()
+        self.showSlide()
+        lead = self.deadlines.lead()
+        late = self.deadlines.shown(self.delayms / 1000)
+        self.prefetch()
+        if self.timings is not None:
+            self.end_timing('slide', path=self.title, late_ms=round(late * 1000, 3), lead_ms=round(lead * 1000, 3),
+                            missed=late > SCHEDULE_LATE_MS / 1000)
+        self.looperid = self.root.after(self.deadlines.wait_ms(self.deadlines.lead()), self.showloop)
+
+    def get_forward(self):
+        if self.shuffle:
+            # random (forward through history first, if gone back)
+            if self.historyBack > 0:
+                self.history_step(-1)
             else:
-                # next
-                self.get_next()
-            self.show()
-        # requeue in loop
-        self.looperid = self.root.after(self.delayms, self.showloop)
+                self.get_rand()
+        else:
+            # next
+            self.get_next()
+
+    def get_backward(self):
+        if self.shuffle and self.historyBack + 1 < len(self.history):
+            self.history_step(1)
+        else:
+            self.get_prev()
+
+    def history_index(self, back):
+        '''
+        Index of the path shown back steps before the last one (None if gone).
+        '''
+        return self.imagepaths.index_of(self.history[-1 - back])
+
+    def history_step(self, step):
+        # deleted images are passed over
+        back = self.historyBack + step
+        while 0 <= back < len(self.history):
+            index = self.history_index(back)
+            if index is not None:
+                self.historyBack = back
+                self.previous = self.index
+                self.index = index
+                return
+            back += step
+        if step < 0:
+            self.historyBack = 0
+            self.get_rand()
 
     def get_rand(self):
         self.previous = self.index
-        # this math avoids repeating the current image
-        newindex = randint(0,self.length-2)
-        newindex += 1 if newindex >= self.index else 0
-        self.index = newindex
+        if self.randQueue and self.randQueue[0] != self.index:
+            # already drawn (and prefetched)
+            self.index = self.randQueue.popleft()
+        else:
+            self.randQueue.clear()
+            self.index = self.draw_rand(self.index)
+        # remember the order, dropping anything gone back past
+        for i in range(self.historyBack):
+            self.history.pop()
+        self.historyBack = 0
+        current = self.imagepaths[self.previous]
+        if not self.history or self.history[-1] != current:
+            self.history.append(current)
+        self.history.append(self.imagepaths[self.index])
+
+    def draw_rand(self, index):
+        '''
+        Next index of the shuffled order, avoiding the current image,
+        deleted ones and (while there are plenty of others) recently shown ones.
+        '''
+        if len(self.imagepaths) < 2:
+            return index
+        avoidRecent = len(self.imagepaths) > 2 * len(self.history)
+        for i in range(64):
+            newindex = self.shuffler.next()
+            if newindex != index and self.imagepaths.is_alive(newindex) and \
+               not (avoidRecent and self.imagepaths[newindex] in self.history):
+                return newindex
+        return self.step(index, 1)
+
+    def step(self, index, step):
+        '''
+        Next (or previous) live entry, skipping deleted ones.
+        '''
+        if step > 0:
+            return self.imagepaths.next_alive((index + 1) % self.length)
+        else:
+            return self.imagepaths.prev_alive((index - 1) % self.length)
 
     def get_prev(self):
         self.previous = self.index
-        self.index = (self.index - 1) % self.length
+        self.index = self.step(self.index, -1)
 
     def get_next(self):
         self.previous = self.index
-        self.index = (self.index + 1) % self.length
+        self.index = self.step(self.index, 1)
 
     def toggle_fullscreen(self, event=None):
         self.fullscreen = not self.fullscreen
-        #pdb.set_trace()
+        #import pdb; pdb.set_trace()
         self.root.attributes("-fullscreen", self.fullscreen)
         if self.fullscreen:
             self.width = self.root.winfo_screenwidth()
@@ -382,49 +3923,53 @@ class SlideShow:
         return "break"
 
     def show_and_reset_timer(self):
+        if self.root is None:
+            self.show()
+            return
         if self.looperid:
             self.root.after_cancel(self.looperid)
+            self.looperid = None
+        self.drop_pending()
         self.show()
-        self.looperid = self.root.after(self.delayms, self.showloop)
+        self.schedule()
 
     def next_index(self, event=None):
-        if self.shuffle:
-            self.get_rand()
-        else:
-            self.get_next()
+        self.get_forward()
         self.show_and_reset_timer()
         return "break"
 
     def prev_index(self, event=None):
-        self.get_prev()
+        self.get_backward()
         self.show_and_reset_timer()
         return "break"
 
     def first_of_next_dir(self):
-        current_dir = self.imagepaths[self.index].parent
-        # move until folder does not match
-        temp = self.index
-        for i in range(self.length):
-            temp = (temp + 1) % self.length
-            if not current_dir.samefile(self.imagepaths[temp].parent):
-                break
-        else:
-            # failed to find a different folder, just get next
-            temp = (self.index + 1) % self.length
-        return temp
+        starts, dirs, alive = self.folder_runs()
+        run = self.run_of(self.index)
+        current_dir = dirs[run]
+        # move run by run until folder does not match
+        # (only the runs either side of the wrap-around can match)
+        count = len(starts)
+        for i in range(1, count):
+            temp = (run + i) % count
+            if dirs[temp] != current_dir:
+                return self.imagepaths.next_alive(starts[temp])
+        # failed to find a different folder, just get next
+        return self.step(self.index, 1)
 
     def last_of_prev_dir(self):
-        current_dir = self.imagepaths[self.index].parent
-        # move until folder does not match
-        temp = self.index
-        for i in range(self.length):
-            temp = (temp - 1) % self.length
-            if not current_dir.samefile(self.imagepaths[temp].parent):
-                break
-        else:
-            # failed to find a different folder, just get next
-            temp = (self.index + 1) % self.length
-        return temp
+        starts, dirs, alive = self.folder_runs()
+        run = self.run_of(self.index)
+        current_dir = dirs[run]
+        # move run by run until folder does not match
+        count = len(starts)
+        for i in range(1, count):
+            temp = (run - i) % count
+            if dirs[temp] != current_dir:
+                # last entry of that run
+                return self.imagepaths.prev_alive((starts[(temp + 1) % count] - 1) % self.length)
+        # failed to find a different folder, just get next
+        return self.step(self.index, 1)
 
     def next_dir(self, event=None):
         self.previous = self.index
@@ -445,7 +3990,7 @@ class SlideShow:
 
     def go_back(self, event=None):
         temp = self.index
-        self.index = self.previous
+        self.index = self.imagepaths.next_alive(self.previous)
         self.previous = temp
         self.show_and_reset_timer()
         return "break"
@@ -458,6 +4003,76 @@ class SlideShow:
         self.shuffle = not self.shuffle
         return "break"
 
+    def set_filter(self, filter):
+        '''
+        Show what filter picks from the catalog, staying on the current image if it is picked,
+        or else going to the one after where it would be in the filter's order.
+        Returns False, keeping the filter shown, if it picks nothing.
+        '''
+        view = self.catalog.view(filter, self.shared)
+        if not view:
+            print(f'No images match "{filter}"')
+            return False
+        current = self.imagepaths[self.index] if self.imagepaths else None
+        self.filter = filter
+        self.imagepaths = view
+        self.update_runs()
+        index = view.index_of(current) if current is not None else None
+        if index is None:
+            index = view.next_alive(view.bisect(current) if current is not None else 0)
+        self.index = self.previous = index
+        self.history.clear()
+        self.historyBack = 0
+        if self.root:
+            self.root.wm_title(self.window_title())
+        self.show_and_reset_timer()
+        return True
+
+    def edit_filter(self, event=None):
+        '''
+        Type a filter (see Filter) over the bottom of the window, enter applies it, escape closes.
+        '''
+        if self.filterEntry is None:
+            entry = tk.Entry(self.frame, bg='#202020', fg='white', insertbackground='white', relief='flat')
+            # only the entry's own bindings, not the window's keys
+            entry.bindtags((str(entry), 'Entry'))
+            entry.bind('<Return>', self.apply_filter)
+            entry.bind('<Escape>', self.close_filter)
+            self.filterEntry = entry
+        entry = self.filterEntry
+        entry.config(bg='#202020')
+        entry.delete(0, tk.END)
+        entry.insert(0, self.filter.text)
+        entry.place(relx=0, rely=1, relwidth=1, anchor='sw')
+        entry.focus_set()
+        return "break"
+
+    def apply_filter(self, event=None):
+        try:
+            # (the --regex given stays)
+            filter = Filter(self.filterEntry.get(), self.filter.regex)
+        except ValueError as e:
+            print(f'Bad filter: {e}')
+            self.filterEntry.config(bg='#602020')
+            return "break"
+        if self.set_filter(filter):
+            self.close_filter()
+        else:
+            self.filterEntry.config(bg='#602020')
+        return "break"
+
+    def close_filter(self, event=None):
+        self.filterEntry.place_forget()
+        self.root.focus_set()
+        return "break"
+
+    def cycle_sort(self, event=None):
+        # next of SORTS, keeping the filter's terms
+        sort = SORTS[(SORTS.index(self.filter.sort) + 1) % len(SORTS)]
+        print(f'Sort: {sort}')
+        self.set_filter(self.filter.sorted(sort))
+        return "break"
+
     def speed_up(self, event=None):
         self.delayms += DELAY_INC_MS
         return "break"
@@ -466,18 +4081,57 @@ class SlideShow:
         self.delayms = max(self.delayms - DELAY_INC_MS, DELAY_MIN_MS)
         return "break"
 
+    def drop_index(self, index):
+        '''
+        Remove an entry from the slide show (not from the disk).
+        '''
+        return self.drop_indices([index])
+
+    def drop_indices(self, indices):
+        '''
+        Remove entries from the slide show (not from the disk), staying on the current
+        (and previous) image, or the one after it if removed.
+        Returns whether the current image was removed.
+        '''
+        if not indices:
+            return False
+        for index in indices:
+            if self.imagepaths.is_alive(index):
+                self.remove_from_runs(index)
+                self.imagepaths.delete(index)
+        self.randQueue.clear()
+        self.drop_pending()
+        removed = not self.imagepaths.is_alive(self.index)
+        if self.imagepaths:
+            self.index = self.imagepaths.next_alive(self.index)
+            self.previous = self.imagepaths.next_alive(self.previous)
+            self.compact()
+        return removed
+
     def delete_file(self, event=None):
         path = self.imagepaths[self.index]
-        # remove it from slideshow
-        self.imagepaths = self.imagepaths[:self.index] + self.imagepaths[self.index+1:]
-        self.length -= 1
-        # delete
+        if archiveOf(path):
+            # archives are only read, never rewritten
+            print(f'Not deleting "{path}": it is in an archive (delete the folder to delete the archive)')
+            return "break"
+        # remove it from slideshow (and the other panes)
+        for pane in self.remove_paths([path]):
+            if pane is self:
+                continue
+            if pane.imagepaths:
+                pane.show_and_reset_timer()
+            else:
+                pane.close_out()
+        # delete (an animation keeps its file open)
+        self.stop_animation()
         print(f'Delete file: "{path}"')
+        from send2trash import send2trash
         send2trash(str(path))
         # change image (close if none left)
-        if self.length > 0:
-            self.index %= self.length
+        if self.imagepaths:
             self.show_and_reset_timer()
+        elif self.lead is not self:
+            return self.close_out()
         else:
             try:
                 self.root.destroy()
@@ -486,22 +4140,36 @@ class SlideShow:
             return "break"
 
     def delete_folder(self, event=None):
-        # save current-index and previous-index-not-in-this-folder
-        index = self.index
-        prev_dir_index = self.last_of_prev_dir()
         # delete folder
         dir = self.imagepaths[self.index].parent
-        print(f'Delete folder: "{dir}"')
-        for item in dir.rglob('*'):
-            print(f'Delete file: "{item}"')
+        member = archiveOf(self.imagepaths[self.index])
+        if member:
+            if Path(member[0]) != dir:
+                print(f'Not deleting "{dir}": it is a folder in an archive')
+                return "break"
+            print(f'Delete archive: "{dir}"')
+        else:
+            print(f'Delete folder: "{dir}"')
+            for item in dir.rglob('*'):
+                print(f'Delete file: "{item}"')
+        self.stop_animation()
+        # (open archives would keep their files)
+        ARCHIVES.forget(dir)
+        from send2trash import send2trash
         send2trash(str(dir))
-        # easier to simply update full list
-        self.update_imagepaths()
+        # drop it from the list, landing on the first image after it
+        for pane in self.remove_paths(dirs=[dir]):
+            if pane is self:
+                continue
+            if pane.imagepaths:
+                pane.show_and_reset_timer()
+            else:
+                pane.close_out()
         # change image (close if none left)
-        if self.length > 0:
-            self.index = (prev_dir_index + 1) % self.length
-            self.back = index % self.length # last position, even if it doesn't exist
+        if self.imagepaths:
             self.show_and_reset_timer()
+        elif self.lead is not self:
+            return self.close_out()
         else:
             try:
                 self.root.destroy()
@@ -509,7 +4177,56 @@ class SlideShow:
                 pass
             return "break"
 
+    def stop_workers(self):
+        if self.resident:
+            # later launches start up themselves
+            self.resident.close()
+        if self.watcher:
+            self.watcher.close()
+        self.scanner.close()
+        self.prefetcher.close()
+        if self.decoder:
+            self.decoder.close()
+        ARCHIVES.close()
+        if self.library:
+            self.library.close()
+        if self.trace:
+            self.trace.close()
+            self.trace = None
+
+    def close_panes(self):
+        # all but the lead
+        for pane in self.panes[1:]:
+            pane.close_out()
+
     def close_out(self, event=None):
+        if self.lead is not self:
+            # only this pane, the others carry on
+            if self not in self.lead.panes:
+                return "break"
+            self.paused = True
+            self.stop_animation()
+            self.stop_refine()
+            for id in (self.looperid, self.reloadId, self.renderId):
+                if id:
+                    self.root.after_cancel(id)
+            self.prefetcher.want((), owner=self)
+            self.lead.panes.remove(self)
+            self.root.destroy()
+            return "break"
+        if self.resident:
+            # stay warm for the next launch
+            self.hide()
+            return "break"
+        return self.quit()
+
+    def quit(self, event=None):
+        # late slides one by one are in the trace (-v), here only how many
+        missed = sum(pane.deadlines.missed for pane in self.panes)
+        if missed:
+            slides = sum(pane.deadlines.slides for pane in self.panes)
+            print(f'{missed} of {slides} slides went up late')
+        self.stop_workers()
         try:
             self.root.destroy()
         except:
@@ -527,55 +4244,173 @@ class SlideShow:
             self.reloadId = self.root.after(200, self.reload)
 
     def reload_imagepaths(self, event=None):
-        self.update_imagepaths()
+        # (the lead scans for all the panes)
+        self.cache.validate()
+        self.lead.update_imagepaths()
+        if self.lead is not self:
+            self.show_and_reset_timer()
         return "break"
 
 
 if __name__ == '__main__':
-    parser = ArgumentParser()
+    # options each window has its own of (see --pane)
+    paneParser = ArgumentParser(prog='meh.py --pane', add_help=False)
+    paneParser.add_argument('--regex',
+                            nargs='?',
+                            help='regex filter on file paths',
+                            default=r'.')
+    paneParser.add_argument('--filter',
+                            help='show only the images matching every term, e.g. "beach ext:jpg,png dir:2019 size:1M.. mtime:2020..2021-06 w:3000.. sort:-mtime" (a bare term is a regex, / changes it while the slide show runs)',
+                            default='')
+    paneParser.add_argument('--sort',
+                            help='order of the images: {} (- in front for descending)'.format(', '.join(SORTS[:-1]) + ' or ' + SORTS[-1]),
+                            default=None)
+    paneParser.add_argument('-R', '--random',
+                            action='store_true',
+                            help='shuffle order')
+    paneParser.add_argument('-f', '--fullscreen',
+                            action='store_true',
+                            help='set to fullscreen mode')
+    paneParser.add_argument('-z', '--zoomed',
+                            action='store_true',
+                            help='scale images to fit the window (without distorting or obscuring them)')
+    paneParser.add_argument('-a', '--auto',
+                            action='store_true',
+                            help='autoplay (advance after \'delay\' seconds)')
+    paneParser.add_argument('-d', '--delay',
+                            action='store',
+                            type=float,
+                            help='delay (in seconds) before new slide is shown',
+                            default=10)
+    paneParser.add_argument('-g', '--geometry',
+                            action='store',
+                            type=str,
+                            help='window geometry in the form wxh+x+y (from top-left)',
+                            default='')
+    paneParser.add_argument('-p', '--progressive',
+                            action='store_true',
+                            help='when skimming, show a quick rendition of images that are not ready yet, and the full-quality one once stopped on them')
+    parser = ArgumentParser(parents=[paneParser])
     parser.add_argument('paths',
                         nargs='*',
-                        help='path(s) to image(s) or folder(s) of image(s)',
+                        help='path(s) to image(s), folder(s) of image(s) or ZIP/CBZ archive(s) of image(s) (shown like folders)',
                         default=['.'])
-    parser.add_argument('--regex',
-                        nargs='?',
-                        help='regex filter on file paths',
-                        default=r'.')
     parser.add_argument('-r', '--recurse',
                         action='store_true',
                         help='recurse though path directory')
-    parser.add_argument('-R', '--random',
+    parser.add_argument('-v', '--verbose',
+                        nargs='?',
+                        metavar='TRACE',
+                        help='time each stage of showing slides, as JSON lines appended to TRACE (default: stdout) with rolling stats every {} slides'.format(TRACE_REPORT),
+                        const='-',
+                        default=None)
+    parser.add_argument('--cache-mb',
+                        action='store',
+                        type=float,
+                        help='memory (in MB) for decoded images kept for reuse',
+                        default=CACHE_MB)
+    parser.add_argument('--index',
+                        nargs='?',
+                        help='keep an index of scanned folders in this SQLite file (default: meh\'s cache folder) so later scans only list folders that have changed',
+                        const=str(INDEX_PATH),
+                        default=None)
+    parser.add_argument('-w', '--watch',
+                        action='store_true',
+                        help='follow images being added to, removed from or renamed in the folders while the slide show runs')
+    parser.add_argument('--previews',
+                        nargs='?',
+                        type=float,
+                        metavar='MB',
+                        help='keep window-sized previews on disk (in meh\'s cache folder, up to MB) to show zoomed images without decoding the originals again',
+                        const=PREVIEW_MB,
+                        default=None)
+    parser.add_argument('--warm-previews',
                         action='store_true',
-                        help='shuffle order')
-    parser.add_argument('-f', '--fullscreen',
+                        help='make previews for the window size (-g) of the images in paths that --regex and --filter pick, then exit')
+    parser.add_argument('--montage',
+                        metavar='OUT',
+                        help='write contact sheets of the images (those --regex and --filter pick, in --sort order) to OUT (.png or .jpg, numbered if more than one), then exit',
+                        default=None)
+    parser.add_argument('--thumb',
+                        help='largest thumbnail on a contact sheet, wxh',
+                        default='160x120')
+    parser.add_argument('--columns',
+                        type=int,
+                        help='thumbnails across a contact sheet',
+                        default=8)
+    parser.add_argument('--rows',
+                        type=int,
+                        help='thumbnails down a contact sheet (more images make more sheets)',
+                        default=8)
+    parser.add_argument('--labels',
                         action='store_true',
-                        help='set to fullscreen mode')
-    parser.add_argument('-z', '--zoomed',
+                        help='put file names under the thumbnails of a contact sheet')
+    parser.add_argument('-m', '--meta',
                         action='store_true',
-                        help='scale images to fit the window (without distorting or obscuring them)')
-    parser.add_argument('-a', '--auto',
+                        help='read image headers (size, orientation, frames) while scanning, kept in the index if there is one')
+    parser.add_argument('--decode-processes',
+                        type=int,
+                        metavar='N',
+                        help='decode in N processes instead of threads, to use more cores',
+                        default=0)
+    parser.add_argument('--resident',
                         action='store_true',
-                        help='autoplay (advance after \'delay\' seconds)')
-    parser.add_argument('-d', '--delay',
-                        action='store',
-                        type=float,
-                        help='delay (in seconds) before new slide is shown',
-                        default=10)
-    parser.add_argument('-g', '--geometry',
-                        action='store',
-                        type=str,
-                        help='window geometry in the form wxh+x+y (from top-left)',
-                        default='')
-    parser.add_argument('-v', '--verbose',
-                        action='store',
-                        type=str,
-                        help='print debugging info',
-                        default='')
+                        help='hand the paths and options to the meh already running with --resident, if there is one, and exit; otherwise be that meh: keep running for {} minutes after the window is closed, and show what later launches hand over with caches and index warm'.format(RESIDENT_IDLE_S // 60))
+    parser.add_argument('--pane',
+                        action='append',
+                        metavar='OPTIONS',
+                        help='open another window on the same images, caches and decode workers, with its own options (quoted, any of --regex, --filter, --sort, -R, -f, -z, -a, -d, -g and -p), e.g. --pane="-g 960x1080+960+0 -a -d 5 --sort mtime" (with =, as they start with -); may be given more than once',
+                        default=[])
     args = parser.parse_args()
 
+    def parseFilter(args, parser):
+        # --filter with --sort, checked
+        text = args.filter
+        if args.sort:
+            text = '{} sort:{}'.format(text, args.sort).strip()
+        try:
+            Filter(text, args.regex)
+        except ValueError as e:
+            parser.error(str(e))
+        return text
+
+    def parseGeometry(text):
+        # wxh+x+y
+        mat = re.match(r'\s*(?P<width>\d+)x(?P<height>\d+)\+(?P<x>\d+)\+(?P<y>\d+)\s*', text)
+        if mat:
+            return tuple(int(mat.group(name)) for name in ('width', 'height', 'x', 'y'))
+        return 800, 600, 0, 0
+
+    args.filter = parseFilter(args, parser)
+    # each pane's options as SlideShow takes them (see SlideShow.open_panes)
+    panes = []
+    for text in args.pane:
+        pane = paneParser.parse_args(shlex.split(text))
+        width, height, x, y = parseGeometry(pane.geometry)
+        panes.append({'regex':       pane.regex,
+                      'filter':      parseFilter(pane, paneParser),
+                      'fullscreen':  pane.fullscreen,
+                      'zoomed':      pane.zoomed,
+                      'paused':      not pane.auto,
+                      'delay':       pane.delay,
+                      'width':       width,
+                      'height':      height,
+                      'x':           x,
+                      'y':           y,
+                      'shuffle':     pane.random,
+                      'progressive': pane.progressive})
+    args.panes = panes
+
+    if args.resident and not (args.warm_previews or args.montage):
+        # (relative to this launch's folder, not the resident's)
+        args.paths = [os.path.abspath(path) for path in args.paths]
+        if handOff(vars(args)):
+            raise SystemExit
+
     # hide console window
     # https://www.semicolonworld.com/question/43710/how-to-hide-console-window-in-python
     #try:
+    #    import win32gui, win32con
     #    frgrnd_wndw = win32gui.GetForegroundWindow();
     #    wndw_title  = win32gui.GetWindowText(frgrnd_wndw);
     #    if wndw_title.endswith('python.exe') or wndw_title.endswith('py.exe'):
@@ -584,28 +4419,52 @@ if __name__ == '__main__':
     #    pass
 
     # parse geometry
-    mat = re.match(r'\s*(?P<width>\d+)x(?P<height>\d+)\+(?P<x>\d+)\+(?P<y>\d+)\s*', args.geometry)
-    if mat:
-        width  = int(mat.groupdict()['width'])
-        height = int(mat.groupdict()['height'])
-        x      = int(mat.groupdict()['x'])
-        y      = int(mat.groupdict()['y'])
-        #print('geometry {}x{}+{}+{}'.format(width,height,x,y))
-    else:
-        width  = 800
-        height = 600
-        x      = 0
-        y      = 0
-
-    sldshw = SlideShow(pathlist   = args.paths,
-                       recurse    = args.recurse,
-                       regex      = args.regex,
-                       fullscreen = args.fullscreen,
-                       zoomed     = args.zoomed,
-                       paused     = not args.auto,
-                       delay      = args.delay,
-                       width      = width,
-                       height     = height,
-                       x          = x,
-                       y          = y,
-                       shuffle    = args.random)
+    width, height, x, y = parseGeometry(args.geometry)
+
+    if args.warm_previews:
+        decoder = ProcessDecoder(args.decode_processes) if args.decode_processes else None
+        warmPreviews(args.paths, args.recurse, Filter(args.filter, args.regex), (width, height),
+                     PreviewCache(int((args.previews or PREVIEW_MB)*1024*1024)),
+                     workers=args.decode_processes or os.cpu_count(),
+                     decode=decoder or decodeImage)
+        if decoder:
+            decoder.close()
+        raise SystemExit
+
+    if args.montage:
+        mat = re.match(r'\s*(?P<width>\d+)x(?P<height>\d+)\s*', args.thumb)
+        if not mat:
+            parser.error('--thumb must be in the form wxh')
+        decoder = ProcessDecoder(args.decode_processes) if args.decode_processes else None
+        montage(args.paths, args.recurse, Filter(args.filter, args.regex), args.montage,
+                (int(mat.group('width')), int(mat.group('height'))), args.columns, args.rows,
+                labels=args.labels, random=args.random,
+                workers=args.decode_processes or os.cpu_count(),
+                decode=decoder or decodeImage)
+        if decoder:
+            decoder.close()
+        raise SystemExit
+
+    sldshw = SlideShow(pathlist         = args.paths,
+                       recurse          = args.recurse,
+                       regex            = args.regex,
+                       filter           = args.filter,
+                       fullscreen       = args.fullscreen,
+                       zoomed           = args.zoomed,
+                       paused           = not args.auto,
+                       delay            = args.delay,
+                       width            = width,
+                       height           = height,
+                       x                = x,
+                       y                = y,
+                       shuffle          = args.random,
+                       cache_mb         = args.cache_mb,
+                       index            = args.index,
+                       watch            = args.watch,
+                       preview_mb       = args.previews,
+                       trace            = args.verbose,
+                       progressive      = args.progressive,
+                       decode_processes = args.decode_processes,
+                       read_meta        = args.meta,
+                       resident         = Resident() if args.resident else None,
+                       panes            = args.panes)